@@ -1,14 +1,22 @@
 import streamlit as st
 import atexit
+import uuid
 from characters import system_role, instruction
 from chatbot import Chatbot
+from chat_persister import chat_persister
 from common import model
 from function_calling import FunctionCalling, tools
+from intent_router import intent_router
+from memory_scheduler import memory_scheduler
+from moderation_gate import moderation_gate
+from tool_cache import tool_cache
+from tracing import tracer
 from pathlib import Path
 
 ASSETS = Path(__file__).parent / "assets"
 BANNER = str(ASSETS / "banner2.png")
 AVATAR = str(ASSETS / "persona.png")
+STREAMING = True   # 답변을 토큰 단위로 흘려서 출력 (False면 완성된 답변을 한 번에 출력)
 
 # 기본 페이지 설정
 st.set_page_config(
@@ -18,7 +26,26 @@ st.set_page_config(
 st.image(BANNER, use_container_width=True)   # 배너설정
 st.title("나만의 경제 전문가 고비와 대화하기")
 
+@st.cache_resource
+def start_background_services():
+    # 프로세스당 한 번만 실행된다 (스크립트가 매번 재실행되고 세션이 늘어나도 그대로)
+    # - 프로세스가 끝날 때 write-behind 큐에 남은 대화를 마저 저장
+    # - 이전 실행에서 저장하지 못하고 dead-letter 파일에 남긴 대화를 다시 저장
+    # - 하루 한 번 기억 만들기를 맡는 공용 스케줄러 스레드 시작
+    atexit.register(chat_persister.close)
+    chat_persister.replay_dead_letter()
+    memory_scheduler.start()
+    return memory_scheduler
+
+start_background_services()
+
 # 세션 초기화 (대화 기록, 챗봇, 함수 호출기)
+# 0) 브라우저 세션마다 대화를 따로 저장/복원하도록 세션 id를 만든다.
+#    URL 쿼리(?sid=)에 넣어 두어 새로고침해도 같은 대화가 복원되고, 새 탭은 새 대화로 시작한다.
+if "session_id" not in st.session_state:
+    st.session_state.session_id = st.query_params.get("sid") or uuid.uuid4().hex
+    st.query_params["sid"] = st.session_state.session_id
+
 # 1) 챗봇 먼저 생성 (context + DB 복원)
 if "chatbot" not in st.session_state:
     st.session_state.chatbot = Chatbot(
@@ -27,12 +54,14 @@ if "chatbot" not in st.session_state:
         instruction=instruction,
         user="사용자",
         assistant="고비",
+        session_id=st.session_state.session_id,
     )
+    memory_scheduler.register(user="사용자", assistant="고비")
 
-# 2) history가 없다면, DB에서 불러온 대화로 채우기
+# 2) history가 없다면, 챗봇이 복원해 둔 최근 대화로 채우기 (DB를 다시 읽지 않는다)
 if "history" not in st.session_state:
     st.session_state.history = []
-    restored = st.session_state.chatbot.memoryManager.restore_chat()
+    restored = st.session_state.chatbot.restored
     for m in restored:
         # developer/system은 빼고 user/assistant만 화면에 보여주기
         if m["role"] in ("user", "assistant"):
@@ -50,6 +79,17 @@ for msg in st.session_state.history:
     with st.chat_message(msg["role"], avatar=avatar):
         st.markdown(msg["content"])
 
+def render_answer(response):
+    # 스트리밍이면 조각이 도착하는 대로 그리고, 조립된 전체 답변 문자열을 돌려준다.
+    # 스트림이 중간에 끊기면 화면에는 받은 부분과 오류 안내가 남고, None을 돌려 대화/DB에는 넣지 않는다
+    if STREAMING:
+        shown = st.write_stream(response)
+        if getattr(response, "failed", False):
+            return None
+        return shown
+    st.markdown(response.output_text)
+    return response.output_text
+
 # 사용자 입력
 user_text = st.chat_input("고비에게 질문해보세요!")
 
@@ -64,42 +104,98 @@ if user_text:   #사용자 입력 들어오면 프로그램 동작 시작
     chatbot = st.session_state.chatbot
     fcaller = st.session_state.fcaller
 
-    chatbot.add_user_message(user_text)
-
+    # 이번 턴의 단계별 span을 모아 턴이 끝나면 logs/traces.jsonl에 한 줄로 남긴다
+    trace = tracer.start_turn(user=chatbot.user, message_chars=len(user_text))
+    outcome = 'error'   # 턴 도중 예외가 나도(대체 답변 요청까지 실패해도) 트레이스는 남긴다
     try:
-        # 함수 호출 분석 시도
-        prev_resp, _ = fcaller.analyze(user_text, tools)
-
-        # GPT가 실제로 함수를 요청했는지 확인
-        has_tool_call = any(
-            hasattr(item, "type") and item.type == "function_call"
-            for item in prev_resp.output
-        )
-
-        if has_tool_call:
-            # 함수 실행 및 결과 전달
-            final_resp = fcaller.run(
-                previous_response=prev_resp,
-                context=chatbot.context
-            )
-
-            chatbot.add_response(final_resp)
-            answer = chatbot.get_last_response()
+        chatbot.add_user_message(user_text)
+
+        # 로컬 라우터로 먼저 판단: 확실하면 analyze(LLM) 호출을 건너뛴다
+        route = intent_router.route(user_text)
+        trace.attrs['route'] = route.decision
+        intent_router.shadow(user_text, route, fcaller.analyze_calls)
+
+        # 동시 모드면 안전성 점검/기억 조회를 도구 분석과 병렬로 먼저 시작
+        prepared = chatbot.prepare_request() if chatbot.concurrent and route.decision != "tools" else None
+
+        # 결과 출력 (스트리밍이면 첫 토큰부터 바로 그려진다)
+        with st.chat_message("assistant", avatar=AVATAR):
+            rendering = False   # 답변을 그리기 시작했으면 예외가 나도 일반 대화로 한 번 더 답하지 않는다
+            try:
+                if route.decision == "tools":
+                    # 도구와 인자가 분명하면 analyze 없이 바로 실행
+                    final_resp = fcaller.run_direct(route.calls, context=chatbot.context, stream=STREAMING)
+                else:
+                    has_tool_call = False
+                    if route.decision == "llm":
+                        # 함수 호출 분석 시도
+                        prev_resp, _ = fcaller.analyze(user_text, tools)
+
+                        # GPT가 실제로 함수를 요청했는지 확인
+                        has_tool_call = any(
+                            hasattr(item, "type") and item.type == "function_call"
+                            for item in prev_resp.output
+                        )
+
+                    if has_tool_call:
+                        # 일반 대화용 사전 단계(안전성 점검/기억 조회)는 더 필요 없으니 멈춘다
+                        chatbot.cancel_prepared(prepared)
+                        prepared = None
+                        # 함수 실행 및 결과 전달
+                        final_resp = fcaller.run(
+                            previous_response=prev_resp,
+                            context=chatbot.context,
+                            stream=STREAMING
+                        )
+                    else:
+                        # 도구 호출이 없으면 일반 대화로
+                        final_resp = chatbot.send_request(prepared=prepared, stream=STREAMING)
+
+                rendering = True
+                answer = render_answer(final_resp)
+                note = ""
+
+            except Exception as e:
+                answer = None
+                if not rendering:
+                    # 답변을 그리기 전에 실패했으면 일반 대화로 답한다
+                    answer = render_answer(chatbot.send_request(prepared=prepared, stream=STREAMING))
+                st.markdown(f"(참고: {e})")
+                note = f"\n(참고: {e})"
+
+        if answer is not None:
+            chatbot.add_response(answer)
         else:
-            # 도구 호출이 없으면 일반 대화로
-            response = chatbot.send_request()
-            chatbot.add_response(response)
-            answer = chatbot.get_last_response()
-
-    except Exception as e:
-        # 예외시에도 일반 대화
-        response = chatbot.send_request()
-        chatbot.add_response(response)
-        answer = chatbot.get_last_response() + f"\n(참고: {e})"
-
-    chatbot.save_chat()
-
-    # 결과 출력
-    st.session_state.history.append({"role": "assistant", "content": answer})
-    with st.chat_message("assistant", avatar=AVATAR):
-        st.markdown(answer)
+            # 끊긴 답변은 대화와 DB에 넣지 않고 화면 기록에만 끊겼다고 남긴다
+            answer = "[답변이 중간에 끊겼습니다. 다시 질문해 주세요]"
+        chatbot.save_chat()   # 큐에 넣기만 하고 바로 돌아온다 (저장은 백그라운드)
+        outcome = 'ok'
+    finally:
+        tracer.end_turn(trace, outcome)
+
+    st.session_state.history.append({"role": "assistant", "content": answer + note})
+
+# 사이드바: 이 프로세스에서 처리한 최근 턴들의 단계별 지연 시간(p50/p95)과 평균 토큰
+with st.sidebar:
+    st.subheader("단계별 지연 시간")
+    summary = tracer.summary()
+    if summary:
+        st.dataframe(summary, hide_index=True, use_container_width=True)
+    else:
+        st.caption("아직 기록된 턴이 없습니다.")
+
+    # 안전성 점검에서 LLM 판정을 건너뛴 비율과 그만큼 아낀 시간
+    st.subheader("안전성 점검")
+    moderation = moderation_gate.stats()
+    st.caption(f"LLM 생략 {moderation['llm_skip_rate']:.0%} "
+               f"(캐시 {moderation['cache_hit']} · 로컬 통과 {moderation['local_safe']} · LLM {moderation['llm']}), "
+               f"턴당 약 {moderation['saved_ms_per_turn']:.0f}ms 절약")
+
+    # 도구 결과 캐시: 적중(hits), 실제 호출(misses), 같은 호출 기다려 공유(shared)
+    st.subheader("도구 캐시")
+    tool_stats = tool_cache.stats()
+    if tool_stats:
+        st.dataframe([{'tool': tool, **counts} for tool, counts in tool_stats.items()],
+                     hide_index=True, use_container_width=True)
+    else:
+        st.caption("아직 도구 호출이 없습니다.")
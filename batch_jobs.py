@@ -0,0 +1,281 @@
+from common import client
+from embedding_cache import embedding_cache, embedding_model
+from memory_manager import MemoryManager, topic_request, SUMMARIZING_TEMPLATE, MERGING_TEMPLATE
+from memory_summarizer import chunk_by_tokens, message_tokens, fingerprint, SUMMARY_CHUNK_TOKENS, MAX_TOPICS
+
+import argparse
+import hashlib
+import json
+import os
+from datetime import datetime, timedelta
+
+# 기간 단위 기억 만들기(백필)를 OpenAI Batch API 형식의 JSONL 파일로 처리한다.
+#   1) summaries START END : 날짜별 대화를 청크로 나눠 요약 요청 파일 작성
+#   2) merges              : 요약 결과를 모아 주제가 5개를 넘는 날짜의 합치기 요청 파일 작성
+#   3) embeddings          : 최종 주제의 임베딩 요청 파일 작성 (임베딩 캐시에 있는 것은 제외)
+#   4) ingest              : 임베딩 결과를 캐시에 넣고 save_memories로 한 번에 저장
+# 각 요청 파일은 submit/download로 Batch API에 맡기거나, run-local로 같은 형식의 결과 파일을 만든다.
+# run-local --fake는 API를 부르지 않고 정해진 응답으로 결과 파일을 만들어 전체 흐름을 오프라인으로 시험한다.
+
+BATCH_DIR = os.getenv('BATCH_DIR', 'batch')
+BATCH_COMPLETION_WINDOW = '24h'
+
+SUMMARY_REQUESTS = 'summary_requests.jsonl'
+SUMMARY_RESULTS = 'summary_results.jsonl'
+MERGE_REQUESTS = 'merge_requests.jsonl'
+MERGE_RESULTS = 'merge_results.jsonl'
+EMBEDDING_REQUESTS = 'embedding_requests.jsonl'
+EMBEDDING_RESULTS = 'embedding_results.jsonl'
+TOPICS_FILE = 'topics.json'   # 단계 사이에 넘기는 날짜별 주제 목록
+
+
+def batch_path(name):
+    return os.path.join(BATCH_DIR, name)
+
+
+def date_range(start, end):
+    day = datetime.strptime(start, '%Y%m%d')
+    last = datetime.strptime(end, '%Y%m%d')
+    while day <= last:
+        yield day.strftime('%Y%m%d')
+        day += timedelta(days=1)
+
+
+def write_requests(path, requests, url):
+    # requests: [(custom_id, body), ...]. custom_id는 입력 내용으로 정해지므로 다시 만들어도 같다
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        for custom_id, body in requests:
+            f.write(json.dumps({'custom_id': custom_id, 'method': 'POST', 'url': url, 'body': body},
+                               ensure_ascii=False) + '\n')
+    print(f'> batch: {path}에 요청 {len(requests)}개 작성')
+    return len(requests)
+
+
+def read_results(path):
+    # 성공한 결과만 {custom_id: 응답 본문}으로 돌려준다
+    results, failed = {}, []
+    if not os.path.exists(path):
+        return results
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            record = json.loads(line)
+            response = record.get('response') or {}
+            if record.get('error') or response.get('status_code') != 200:
+                failed.append(record['custom_id'])
+                continue
+            results[record['custom_id']] = response['body']
+    if failed:
+        print(f'> batch: {path}에서 실패한 요청 {len(failed)}개: {failed[:5]}')
+    return results
+
+
+def response_text(body):
+    # Responses API 응답 본문(JSON)에서 output_text를 모은다
+    return ''.join(
+        content['text']
+        for item in body.get('output', []) if item.get('type') == 'message'
+        for content in item.get('content', []) if content.get('type') == 'output_text'
+    )
+
+
+def embedding_id(text):
+    return 'embedding:' + hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+def load_topics():
+    with open(batch_path(TOPICS_FILE), 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_topics(topics_by_date):
+    with open(batch_path(TOPICS_FILE), 'w', encoding='utf-8') as f:
+        json.dump(topics_by_date, f, ensure_ascii=False, indent=4)
+
+
+def prepare_summaries(manager, start, end):
+    requests = []
+    for date in date_range(start, end):
+        messages = manager.load_chats(date)
+        if not messages:
+            continue
+        chunks = chunk_by_tokens(messages, SUMMARY_CHUNK_TOKENS, message_tokens)
+        key = fingerprint(messages, SUMMARY_CHUNK_TOKENS)[:12]
+        for i, chunk in enumerate(chunks):
+            body = topic_request(SUMMARIZING_TEMPLATE, manager.dialogue_payload(chunk))
+            requests.append((f'summary:{date}:{i}:{len(chunks)}:{key}', body))
+    return write_requests(batch_path(SUMMARY_REQUESTS), requests, '/v1/responses')
+
+
+def prepare_merges():
+    chunks_by_date, counts = {}, {}
+    for custom_id, body in read_results(batch_path(SUMMARY_RESULTS)).items():
+        _, date, i, count, _ = custom_id.split(':')
+        try:
+            chunks_by_date.setdefault(date, {})[int(i)] = json.loads(response_text(body))['data']
+        except (json.JSONDecodeError, KeyError) as e:
+            print(f'> batch: {custom_id} 결과를 읽지 못함:{e}')
+        counts[date] = int(count)
+
+    topics_by_date = {}
+    for date, chunks in sorted(chunks_by_date.items()):
+        if len(chunks) != counts[date]:
+            # 청크가 하나라도 빠진 날짜는 저장하지 않는다 (요약 요청을 다시 돌려야 함)
+            print(f'> batch: {date} 청크 {counts[date]}개 중 {len(chunks)}개만 있어 건너뜀')
+            continue
+        topics_by_date[date] = [topic for i in sorted(chunks) for topic in chunks[i]]
+    save_topics(topics_by_date)
+
+    requests = [
+        (f'merge:{date}', topic_request(MERGING_TEMPLATE, topics))
+        for date, topics in topics_by_date.items() if len(topics) > MAX_TOPICS
+    ]
+    return write_requests(batch_path(MERGE_REQUESTS), requests, '/v1/responses')
+
+
+def prepare_embeddings():
+    topics_by_date = load_topics()
+    for custom_id, body in read_results(batch_path(MERGE_RESULTS)).items():
+        date = custom_id.split(':')[1]
+        try:
+            topics_by_date[date] = json.loads(response_text(body))['data']
+        except (json.JSONDecodeError, KeyError) as e:
+            print(f'> batch: {custom_id} 결과를 읽지 못함:{e}')
+    for date, topics in topics_by_date.items():
+        if len(topics) > MAX_TOPICS:
+            print(f'> batch: {date} 주제 {len(topics)}개를 {MAX_TOPICS}개로 자름')
+            topics_by_date[date] = topics[:MAX_TOPICS]
+    save_topics(topics_by_date)
+
+    texts = {topic['요약'] for topics in topics_by_date.values() for topic in topics}
+    requests = [
+        (embedding_id(text), {'model': embedding_model, 'input': text})
+        for text in sorted(texts)
+        if embedding_cache.get(embedding_cache.make_key(text, embedding_model)) is None
+    ]
+    return write_requests(batch_path(EMBEDDING_REQUESTS), requests, '/v1/embeddings')
+
+
+def ingest(manager):
+    topics_by_date = load_topics()
+    results = read_results(batch_path(EMBEDDING_RESULTS))
+    for topics in topics_by_date.values():
+        for topic in topics:
+            body = results.get(embedding_id(topic['요약']))
+            if body is not None:
+                embedding_cache.put(embedding_cache.make_key(topic['요약'], embedding_model),
+                                    embedding_model, body['data'][0]['embedding'])
+
+    # 날짜별 기존 기억을 지우고, 캐시에 들어간 임베딩으로 한 번에 저장 (빠진 임베딩만 즉시 요청)
+    for date in topics_by_date:
+        manager.delete_by_date(date)
+    ids = manager.save_memories(topics_by_date)
+    print(f'> batch: {len(topics_by_date)}일치 기억 {len(ids)}개 저장, embedding cache: {embedding_cache.stats()}')
+    return ids
+
+
+def openai_responder(request):
+    # 배치 요청 한 줄을 바로 실행하고 응답 본문(JSON)을 돌려준다
+    if request['url'] == '/v1/embeddings':
+        response = client.embeddings.create(**request['body'])
+    else:
+        response = client.responses.create(**request['body'])
+    return response.model_dump()
+
+
+def fake_responder(request):
+    # API 없이 요청 내용으로 정해지는 응답 본문을 만든다 (오프라인 시험용).
+    # 요약/합치기 요청에는 입력의 앞부분을 주제로 하는 주제 목록을, 임베딩 요청에는 텍스트 해시로 만든 벡터를 돌려준다
+    body = request['body']
+    if request['url'] == '/v1/embeddings':
+        digest = hashlib.sha256(body['input'].encode('utf-8')).digest()
+        return {'object': 'list', 'data': [{'object': 'embedding', 'index': 0,
+                                            'embedding': [(b / 255.0) - 0.5 for b in digest] * 48}]}
+    payload = json.loads(body['input'][-1]['content'])
+    texts = [next(iter(item.values())) if '요약' not in item else item['요약'] for item in payload]
+    topics = [{'주제': text[:10], '요약': text} for text in texts[:MAX_TOPICS]]
+    text = json.dumps({'data': topics}, ensure_ascii=False)
+    return {'object': 'response', 'status': 'completed',
+            'output': [{'type': 'message', 'role': 'assistant',
+                        'content': [{'type': 'output_text', 'text': text}]}]}
+
+
+def run_local(request_path, result_path, responder=openai_responder):
+    # Batch API 대신 요청을 하나씩 실행해 같은 형식의 결과 파일을 만든다 (소량 처리/시험용)
+    with open(request_path, 'r', encoding='utf-8') as f:
+        requests = [json.loads(line) for line in f]
+    with open(result_path, 'w', encoding='utf-8') as out:
+        for n, request in enumerate(requests):
+            record = {'id': f'batch_req_{n}', 'custom_id': request['custom_id'], 'response': None, 'error': None}
+            try:
+                record['response'] = {'status_code': 200, 'body': responder(request)}
+            except Exception as e:
+                record['error'] = {'code': type(e).__name__, 'message': str(e)}
+            out.write(json.dumps(record, ensure_ascii=False) + '\n')
+    print(f'> batch: {request_path} 요청 {len(requests)}개 실행 -> {result_path}')
+
+
+def submit(request_path):
+    with open(request_path, 'r', encoding='utf-8') as f:
+        first_line = f.readline()
+    if not first_line.strip():
+        print(f'> batch: {request_path}에 요청이 없어 제출하지 않음')
+        return None
+    endpoint = json.loads(first_line)['url']
+    with open(request_path, 'rb') as f:
+        batch_file = client.files.create(file=f, purpose='batch')
+    batch = client.batches.create(
+        input_file_id=batch_file.id,
+        endpoint=endpoint,
+        completion_window=BATCH_COMPLETION_WINDOW,
+    )
+    print(f'> batch: {request_path} 제출, batch id={batch.id}')
+    return batch.id
+
+
+def download(batch_id, result_path):
+    batch = client.batches.retrieve(batch_id)
+    if batch.status != 'completed':
+        print(f'> batch: {batch_id} 상태 {batch.status}')
+        return False
+    client.files.content(batch.output_file_id).write_to_file(result_path)
+    print(f'> batch: {batch_id} 결과 -> {result_path}')
+    return True
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='기억 만들기 배치 작업')
+    parser.add_argument('--user', default='사용자')
+    parser.add_argument('--assistant', default='고비')
+    commands = parser.add_subparsers(dest='command', required=True)
+    summaries = commands.add_parser('summaries')
+    summaries.add_argument('start')
+    summaries.add_argument('end')
+    commands.add_parser('merges')
+    commands.add_parser('embeddings')
+    commands.add_parser('ingest')
+    local = commands.add_parser('run-local')
+    local.add_argument('requests')
+    local.add_argument('results')
+    local.add_argument('--fake', action='store_true', help='API 대신 정해진 응답으로 실행 (오프라인 시험용)')
+    submitting = commands.add_parser('submit')
+    submitting.add_argument('requests')
+    downloading = commands.add_parser('download')
+    downloading.add_argument('batch_id')
+    downloading.add_argument('results')
+    args = parser.parse_args()
+
+    if args.command == 'summaries':
+        prepare_summaries(MemoryManager(user=args.user, assistant=args.assistant), args.start, args.end)
+    elif args.command == 'merges':
+        prepare_merges()
+    elif args.command == 'embeddings':
+        prepare_embeddings()
+    elif args.command == 'ingest':
+        ingest(MemoryManager(user=args.user, assistant=args.assistant))
+    elif args.command == 'run-local':
+        run_local(args.requests, args.results, fake_responder if args.fake else openai_responder)
+    elif args.command == 'submit':
+        submit(args.requests)
+    elif args.command == 'download':
+        download(args.batch_id, args.results)
@@ -0,0 +1,72 @@
+# 컨텍스트 토큰 계산의 턴당 비용 마이크로 벤치마크
+# 하루치 복원 기록이 커질 때, 전체 재인코딩(gpt_num_tokens) 방식과
+# ContextWindow의 증분 방식(메시지당 1회 인코딩 + O(1) 합계)을 비교한다.
+# 사용법: python benchmarks/bench_context_tokens.py [--stand-in]
+# tiktoken 인코더를 받을 수 없으면(오프라인) 대용 인코더로 잰다. 절대 시간은 실제 BPE와 다르고
+# 두 방식의 차이(이력 크기에 비례하는지 여부)만 비교할 수 있다.
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+os.environ.setdefault('OPENAI_API_KEY', 'benchmark')   # common 임포트 시 클라이언트 생성용 (호출은 하지 않음)
+
+import common
+from common import gpt_num_tokens
+from context_window import ContextWindow
+
+HISTORY_SIZES = [100, 1000, 3000, 6000]
+TURNS = 20
+MESSAGE = '요즘 월급이 들어와도 다음 급여일 전엔 통장이 텅 비는 경우가 많아요. 고정비를 어떻게 줄일 수 있을까요?'
+
+
+class StandInEncoding:
+    # 단어/기호 단위로 자른 뒤 두 글자씩 나누는 결정적인 대용 인코더 (tiktoken.Encoding.encode 자리)
+    PIECE = re.compile(r'\w+|[^\w\s]+|\s+')
+
+    def encode(self, text):
+        return [word[i:i + 2] for word in self.PIECE.findall(text) for i in range(0, len(word), 2)]
+
+
+def use_encoder(stand_in):
+    if not stand_in:
+        try:
+            common.get_encoding()
+            return 'tiktoken'
+        except Exception as e:
+            print(f'> tiktoken 인코더를 불러오지 못해 대용 인코더로 잽니다: {e}')
+    common.get_encoding = lambda model='gpt-4o': StandInEncoding()
+    return 'stand-in'
+
+
+def restored_history(size):
+    return [
+        {'role': 'user' if i % 2 == 0 else 'assistant', 'content': f'{MESSAGE} ({i})', 'saved': True}
+        for i in range(size)
+    ]
+
+
+def bench_full(size):
+    context = restored_history(size)
+    start = time.perf_counter()
+    for i in range(TURNS):
+        context.append({'role': 'user', 'content': f'{MESSAGE} [turn {i}]', 'saved': False})
+        gpt_num_tokens([{'role': m['role'], 'content': m['content']} for m in context])
+    return (time.perf_counter() - start) / TURNS
+
+
+def bench_incremental(size):
+    context = ContextWindow(restored_history(size))
+    start = time.perf_counter()
+    for i in range(TURNS):
+        context.append({'role': 'user', 'content': f'{MESSAGE} [turn {i}]', 'saved': False})
+        context.total_tokens
+    return (time.perf_counter() - start) / TURNS
+
+
+if __name__ == '__main__':
+    print(f'encoder: {use_encoder("--stand-in" in sys.argv[1:])}')
+    print(f'{"history":>8} | {"full re-encode (ms/turn)":>25} | {"incremental (ms/turn)":>22}')
+    for size in HISTORY_SIZES:
+        print(f'{size:>8} | {bench_full(size) * 1000:>25.3f} | {bench_incremental(size) * 1000:>22.4f}')
@@ -0,0 +1,79 @@
+# application.py가 임포트하는 앱 모듈들의 콜드 스타트 임포트 시간 벤치마크
+# 매번 새 인터프리터에서 임포트만 하고(자격 증명 없이), 중앙값이 예산을 넘으면 0이 아닌 코드로 끝난다.
+# streamlit 자체의 임포트 시간은 프레임워크 고정 비용이라 제외한다.
+# 사용법: python benchmarks/bench_import_time.py [예산(초)]
+import ast
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+IMPORT_BUDGET_SECONDS = float(os.getenv('IMPORT_BUDGET_SECONDS', 1.0))
+RUNS = 5
+EXCLUDED = {'streamlit'}
+CREDENTIALS = ['OPENAI_API_KEY', 'PINECONE_API_KEY', 'MONGO_CLUSTER_URI', 'TAVILY_API_KEY']
+
+
+def app_modules():
+    # application.py의 최상위 import 문에서 모듈 이름을 읽는다
+    with open(os.path.join(ROOT, 'application.py'), encoding='utf-8') as f:
+        tree = ast.parse(f.read())
+    modules = []
+    for node in tree.body:
+        if isinstance(node, ast.Import):
+            names = [alias.name for alias in node.names]
+        elif isinstance(node, ast.ImportFrom) and node.level == 0:
+            names = [node.module]
+        else:
+            continue
+        modules += [name for name in names if name.split('.')[0] not in EXCLUDED and name not in modules]
+    return modules
+
+
+def measure(modules):
+    # 새 프로세스에서 임포트에 걸린 시간(초)과 -X importtime 출력을 돌려준다
+    env = {k: v for k, v in os.environ.items() if k not in CREDENTIALS}
+    code = ('import time; start = time.perf_counter(); '
+            + '; '.join(f'import {name}' for name in modules)
+            + '; print(time.perf_counter() - start)')
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code],
+                            cwd=ROOT, env=env, capture_output=True, text=True)
+    if result.returncode != 0:
+        print(result.stderr[-2000:])
+        raise SystemExit(f'임포트 실패 (exit {result.returncode})')
+    return float(result.stdout.strip().splitlines()[-1]), result.stderr
+
+
+def slowest(importtime_log, count=10):
+    # import time: self [us] | cumulative | imported package
+    rows = []
+    for line in importtime_log.splitlines():
+        parts = line.split('|')
+        if len(parts) != 3 or not parts[1].strip().isdigit():
+            continue
+        rows.append((int(parts[1]), parts[2].rstrip()))
+    return sorted(rows, reverse=True)[:count]
+
+
+if __name__ == '__main__':
+    budget = float(sys.argv[1]) if len(sys.argv) > 1 else IMPORT_BUDGET_SECONDS
+    modules = app_modules()
+    print('modules:', ', '.join(modules))
+
+    measure(modules)   # 바이트코드(.pyc) 생성분은 빼고 잰다
+    timings, log = [], ''
+    for _ in range(RUNS):
+        elapsed, log = measure(modules)
+        timings.append(elapsed)
+
+    print(f'{"cumulative (ms)":>16} | module')
+    for cumulative, name in slowest(log):
+        print(f'{cumulative / 1000:>16.1f} | {name}')
+
+    median = statistics.median(timings)
+    print(f'import time: median {median * 1000:.0f} ms, max {max(timings) * 1000:.0f} ms (budget {budget * 1000:.0f} ms)')
+    if median > budget:
+        print('FAIL: 임포트 시간이 예산을 넘었습니다')
+        sys.exit(1)
+    print('OK')
@@ -0,0 +1,76 @@
+# 기억 저장 처리량 벤치마크 (memories/s)
+# 외부 서비스 대신 왕복 지연만 흉내 내는 가짜 클라이언트로, 예전 건별 경로와
+# memory_ingest.ingest_memories의 묶음 경로를 비교한다.
+# 결과는 가정한 왕복 지연으로 계산한 모의 수치이며 실제 서비스 처리량이 아니다.
+# 사용법: python benchmarks/bench_memory_ingest.py [기억 개수]
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+os.environ.setdefault('OPENAI_API_KEY', 'benchmark')   # common 임포트 시 클라이언트 생성용 (호출은 하지 않음)
+
+from memory_ingest import ingest_memories
+
+# 왕복 지연 가정치 (초)
+EMBEDDING_RTT = 0.15
+PINECONE_RTT = 0.04
+MONGO_RTT = 0.01
+
+
+class FakeIndex:
+    def upsert(self, vectors):
+        time.sleep(PINECONE_RTT)
+
+
+class FakeCollection:
+    full_name = 'benchmark.collection'
+
+    def __init__(self):
+        self.seq = 0
+
+    def find_one(self, *args, **kwargs):
+        time.sleep(MONGO_RTT)
+        return None
+
+    def update_one(self, *args, **kwargs):
+        time.sleep(MONGO_RTT)
+
+    def find_one_and_update(self, query, update, **kwargs):
+        time.sleep(MONGO_RTT)
+        self.seq += update['$inc']['seq']
+        return {'_id': 'memory_id', 'seq': self.seq}
+
+    def bulk_write(self, requests, **kwargs):
+        time.sleep(MONGO_RTT)
+
+
+def fake_embed(texts):
+    time.sleep(EMBEDDING_RTT)
+    return [[0.0] * 1536 for _ in texts]
+
+
+def per_item(entries, index, memory_collection):
+    # 예전 save_to_memory / insert_memory.py의 건별 경로
+    memory_collection.find_one(sort=[('_id', -1)])
+    for next_id, entry in enumerate(entries, start=1):
+        vector = fake_embed([entry['summary']])[0]
+        index.upsert([(str(next_id), vector, {'date': entry['date'], 'keyword': entry['keyword']})])
+        memory_collection.update_one({'_id': next_id}, {'$set': entry}, upsert=True)
+
+
+def measure(fn):
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    entries = [{'date': '20251101', 'keyword': f'주제{i}', 'summary': f'민수는 {i}번째 이야기를 했다.'} for i in range(count)]
+
+    before = measure(lambda: per_item(entries, FakeIndex(), FakeCollection()))
+    after = measure(lambda: ingest_memories(entries, FakeIndex(), FakeCollection(), FakeCollection(), embed=fake_embed))
+    print(f'memories: {count}  (embed {EMBEDDING_RTT * 1000:.0f}ms, pinecone {PINECONE_RTT * 1000:.0f}ms, mongo {MONGO_RTT * 1000:.0f}ms RTT 가정, sleep 기반 모의 측정)')
+    print(f'before (건별): {count / before:8.1f} memories/s')
+    print(f'after  (묶음): {count / after:8.1f} memories/s')
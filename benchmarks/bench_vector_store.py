@@ -0,0 +1,45 @@
+# LocalVectorStore 검색 지연 벤치마크
+# 사용자별 기억 규모(수천 개)에서 코사인 top-k 질의가 얼마나 걸리는지 측정한다.
+# 사용법: python benchmarks/bench_vector_store.py
+import os
+import sys
+import time
+import tempfile
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from vector_store import LocalVectorStore
+
+DIMENSION = 1536      # text-embedding-ada-002
+SIZES = [1000, 5000, 20000]
+QUERIES = 200
+
+
+def build_store(size, rng):
+    store = LocalVectorStore(os.path.join(tempfile.mkdtemp(), 'bench'))
+    vectors = rng.standard_normal((size, DIMENSION), dtype=np.float32)
+    store.upsert([
+        (str(i), vectors[i], {'date': f'202511{i % 30 + 1:02}'})
+        for i in range(size)
+    ])
+    return store
+
+
+def bench(store, rng, **kwargs):
+    queries = rng.standard_normal((QUERIES, DIMENSION), dtype=np.float32)
+    start = time.perf_counter()
+    for query in queries:
+        store.query(query, **kwargs)
+    return (time.perf_counter() - start) / QUERIES
+
+
+if __name__ == '__main__':
+    rng = np.random.default_rng(0)
+    print(f'{"vectors":>8} | {"top_k=1 (us)":>13} | {"top_k=10 (us)":>14} | {"top_k=10 + filter (us)":>23}')
+    for size in SIZES:
+        store = build_store(size, rng)
+        top1 = bench(store, rng, top_k=1)
+        top10 = bench(store, rng, top_k=10)
+        filtered = bench(store, rng, top_k=10, filter={'date': {'$gte': '20251115'}})
+        print(f'{size:>8} | {top1 * 1e6:>13.1f} | {top10 * 1e6:>14.1f} | {filtered * 1e6:>23.1f}')
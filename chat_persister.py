@@ -0,0 +1,188 @@
+from pymongo import UpdateOne
+from mongo_store import chats_collection, counters_collection, allocate_seq
+
+import json
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+
+CHAT_FLUSH_BATCH = 50         # 이 개수가 모이면 바로 쓴다
+CHAT_FLUSH_INTERVAL = 1.0     # 첫 메시지가 들어온 뒤 최대 이만큼(초) 기다렸다가 쓴다
+CHAT_WRITE_RETRIES = 3
+# 재시도를 다 써도 못 쓴 도큐먼트를 남겨 두는 파일 (다음 시작 때 replay_dead_letter로 다시 넣는다)
+CHAT_DEAD_LETTER_PATH = os.getenv(
+    'CHAT_DEAD_LETTER_PATH',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'logs', 'chat_dead_letter.jsonl')
+)
+
+
+class ChatPersister:
+    # 대화 저장을 응답 경로에서 떼어내는 write-behind 큐.
+    # save_chat은 도큐먼트를 큐에 넣고 바로 돌아가며, 백그라운드 워커가 개수/시간 기준으로 모아 bulk_write 한다.
+    # 도큐먼트마다 고정된 _id로 upsert($setOnInsert)하므로 재시도해도 중복 저장되지 않는다.
+    # 세션별 순번(seq)도 여기서 배치 단위로 할당해 응답 경로에 카운터 왕복이 생기지 않게 한다.
+    # 재시도를 다 써도 실패한 배치는 dead-letter 파일에 남기고 on_failed 콜백으로 알려 호출한 쪽이 다시 저장하게 한다.
+
+    def __init__(self, collection, counters_collection, batch_size=CHAT_FLUSH_BATCH, flush_interval=CHAT_FLUSH_INTERVAL,
+                 max_retries=CHAT_WRITE_RETRIES, dead_letter_path=CHAT_DEAD_LETTER_PATH):
+        self.collection = collection
+        self.counters_collection = counters_collection
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.dead_letter_path = dead_letter_path
+        self.dead_letter_lock = threading.Lock()
+        self.queue = queue.Queue()
+        self.written = 0
+        self.failed = 0
+        self.batches = 0
+        self._stop = threading.Event()
+        self._worker = threading.Thread(target=self._run, daemon=True, name='chat-persister')
+        self._worker.start()
+
+    def enqueue(self, docs, on_failed=None):
+        # on_failed(docs): 이 도큐먼트들이 끝내 저장되지 못했을 때 워커 스레드에서 호출된다
+        for doc in docs:
+            self.queue.put((doc, on_failed))
+
+    def _next_batch(self):
+        try:
+            batch = [self.queue.get(timeout=self.flush_interval)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size and not self._stop.is_set():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        # 종료 중이면 남은 것을 기다리지 않고 한 번에 가져온다
+        while self._stop.is_set() and len(batch) < self.batch_size:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if not batch:
+                if self._stop.is_set():
+                    return
+                continue
+            try:
+                self._write(batch)
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    def _assign_seq(self, batch):
+        # 큐는 들어온 순서대로 나오므로 세션 안에서 seq 순서가 대화 순서와 같다.
+        # 한 번 할당한 seq는 도큐먼트에 남아 재시도 때 다시 할당하지 않는다.
+        sessions = {}
+        for doc, _ in batch:
+            if 'seq' not in doc:
+                sessions.setdefault(doc['session_id'], []).append(doc)
+        for session_id, docs in sessions.items():
+            first = allocate_seq(self.counters_collection, session_id, len(docs))
+            for i, doc in enumerate(docs):
+                doc['seq'] = first + i
+
+    def _write(self, batch):
+        for attempt in range(self.max_retries):
+            try:
+                self._assign_seq(batch)
+                self.collection.bulk_write(self._requests(batch), ordered=False)
+                self.written += len(batch)
+                self.batches += 1
+                return
+            except Exception as e:
+                print(f'> chat_persister 저장 실패({attempt + 1}/{self.max_retries}):{e}')
+                time.sleep(0.5 * 2 ** attempt)
+        self.failed += len(batch)
+        self._dead_letter(batch)
+
+    def _dead_letter(self, batch):
+        # 조용히 버리지 않는다: 파일에 남기고, 호출한 쪽에 알려 다음 save_chat에서 다시 저장하게 한다
+        print(f'> chat_persister: 메시지 {len(batch)}개를 {self.dead_letter_path}에 남김')
+        try:
+            with self.dead_letter_lock:
+                os.makedirs(os.path.dirname(self.dead_letter_path) or '.', exist_ok=True)
+                with open(self.dead_letter_path, 'a', encoding='utf-8') as f:
+                    for doc, _ in batch:
+                        record = dict(doc, timestamp=doc['timestamp'].isoformat())
+                        f.write(json.dumps(record, ensure_ascii=False) + '\n')
+        except Exception as e:
+            print(f'> chat_persister dead-letter 기록 실패:{e}')
+
+        failed_by_callback = {}
+        for doc, on_failed in batch:
+            if on_failed is not None:
+                failed_by_callback.setdefault(on_failed, []).append(doc)
+        for on_failed, docs in failed_by_callback.items():
+            try:
+                on_failed(docs)
+            except Exception as e:
+                print(f'> chat_persister on_failed 예외:{e}')
+
+    def replay_dead_letter(self):
+        # 이전 실행에서 못 쓴 도큐먼트를 다시 큐에 넣는다 (고정 _id로 upsert하므로 이미 저장된 것은 그대로 둔다)
+        with self.dead_letter_lock:
+            if not os.path.exists(self.dead_letter_path):
+                return 0
+            docs = []
+            with open(self.dead_letter_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        doc = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    doc['timestamp'] = datetime.fromisoformat(doc['timestamp'])
+                    docs.append(doc)
+            os.remove(self.dead_letter_path)
+        self.enqueue(docs)
+        print(f'> chat_persister: dead-letter 메시지 {len(docs)}개 다시 저장')
+        return len(docs)
+
+    def _requests(self, batch):
+        return [
+            UpdateOne(
+                {'_id': doc['_id']},
+                {'$setOnInsert': {k: v for k, v in doc.items() if k != '_id'}},
+                upsert=True,
+            )
+            for doc, _ in batch
+        ]
+
+    def flush(self, timeout=10.0):
+        # 큐에 들어간 도큐먼트가 모두 쓰일 때까지(최대 timeout초) 기다린다
+        deadline = time.monotonic() + timeout
+        while self.queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.05)
+        return self.queue.unfinished_tasks == 0
+
+    def close(self, timeout=10.0):
+        # 종료 시 마지막으로 남은 대화를 모두 쓰고 워커를 멈춘다
+        self._stop.set()
+        flushed = self.flush(timeout)
+        self._worker.join(timeout=self.flush_interval)
+        if not flushed:
+            print(f'> chat_persister: 종료 시 {self.queue.unfinished_tasks}개 메시지를 저장하지 못함')
+        return flushed
+
+    def stats(self):
+        return {
+            'pending': self.queue.unfinished_tasks,
+            'written': self.written,
+            'failed': self.failed,
+            'batches': self.batches,
+        }
+
+
+chat_persister = ChatPersister(chats_collection, counters_collection)
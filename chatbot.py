@@ -1,68 +1,207 @@
-import math
-from common import client, makeup_response, gpt_num_tokens
+from common import client, makeup_response, makeup_stream, stream_text
+from context_window import ContextWindow
+from memory_gate import memory_gate
 from memory_manager import MemoryManager
+from tracing import tracer
 from warning_agent import WarningAgent
 
+import os
 import threading
-import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 # from pprint import pprint
 
+# 한 턴 안의 독립적인 사전 단계(안전성 점검, 기억 판단, 벡터 검색)를 동시에 돌리는 공용 스레드 풀.
+# 모든 Streamlit 세션이 함께 쓰므로, 동시에 처리할 턴 수만큼 단계마다 스레드를 잡아 두어
+# 다른 사용자의 gpt-5 호출 뒤에서 줄 서지 않게 한다 (스레드는 필요할 때만 만들어진다)
+PIPELINE_STAGES = 3
+MAX_CONCURRENT_TURNS = int(os.getenv('MAX_CONCURRENT_TURNS', 16))
+pipeline_executor = ThreadPoolExecutor(max_workers=MAX_CONCURRENT_TURNS * PIPELINE_STAGES,
+                                       thread_name_prefix='pipeline')
+
 
 class Chatbot:
 
     def __init__(self, model, system_role, instruction, **kwargs):
-        self.context = [{'role': 'developer', 'content': system_role}]
+        self.context = ContextWindow([{'role': 'developer', 'content': system_role}])
         self.model = model
         self.instruction = instruction
         self.max_token_size = 16 * 1024
+        self.keep_recent = kwargs.get('keep_recent', 8)   # 요약하지 않고 원문으로 남길 최근 메시지 수
+        self.summary_max_tokens = 1024                     # 누적 요약에 허용할 최대 토큰
+        self.eviction_ratio = 0.75                         # 예산 초과 시 예산의 이 비율까지 한 번에 비워 요약 호출 횟수를 줄인다
+        self.summary_topics = []
+        # instructions는 고정이므로 토큰 수를 한 번만 계산해 둔다
+        self.instruction_tokens = ContextWindow.count_tokens({"role": "developer", "content": str(instruction)})
         self.kwargs = kwargs
         self.user = kwargs['user']
         self.assistant = kwargs['assistant']
-        self.memoryManager = MemoryManager(user=self.user, assistant=self.assistant)
-        self.context.extend(self.memoryManager.restore_chat())
+        self.concurrent = kwargs.get('concurrent', True)   # False면 기존 직렬 경로 사용
+        # previous_response_id로 서버에 저장된 대화를 이어 붙이고, 아직 보내지 않은 메시지만 전송한다.
+        # 재시작 직후, 컨텍스트 축약 후, 체인이 깨졌을 때는 전체 컨텍스트로 다시 만든다.
+        self.chaining = kwargs.get('chaining', True)
+        self.previous_response_id = None
+        self.reply_chained = False                         # 직전 응답이 체인에 포함된 응답인지 (add_response에서 사용)
+        self.turn_usage = deque(maxlen=100)                # 턴별 전송/입력 토큰 기록
+        self.memoryManager = MemoryManager(user=self.user, assistant=self.assistant,
+                                           session_id=kwargs.get('session_id', self.user))
+        # 최근 대화만 한 번 복원해 컨텍스트와 화면(history)이 같이 쓴다
+        self.restored = self.memoryManager.restore_chat()
+        self.context.extend(self.restored)
         self.warningAgent = self._create_warning_agent()
-        # 데몬 스레드 시작
-        bg_thread = threading.Thread(target=self.background_task, daemon=True)
-        bg_thread.start()
-    def background_task(self):
-        while True:
-            self.save_chat()
-            self.memoryManager.build_memory()
-            time.sleep(3600)
+        # 기억 만들기는 세션마다 스레드를 두지 않고 프로세스 공용 memory_scheduler가 맡는다
+
     def add_user_message(self, message):
         self.context.append({'role': 'user', 'content': message, 'saved': False})
 
-    def _is_over_token_limit(self):
+    def _is_over_token_limit(self, extra_tokens=0):
         # instructions를 보수적으로 developer(system) 메시지로 합산해 계산
-        token_check_target = self.to_openai_context() + [
-            {"role": "developer", "content": str(self.instruction)}
-        ]
-        try:
-            return gpt_num_tokens(token_check_target) > self.max_token_size
-        except Exception:
-            return False
+        return self.context.total_tokens + self.instruction_tokens + extra_tokens > self.max_token_size
 
-    def _send_request(self, extra_instruction: str = ""):
+    def fit_context(self, extra_instruction=""):
+        # 요청 전에 토큰 예산을 맞춘다: 개발자 프롬프트는 고정, 최근 메시지는 원문 유지,
+        # 예산을 넘기면 오래된 메시지를 MemoryManager.summarize로 누적 요약에 접어 넣는다.
+        # 추가 지시문(기억 지시문)의 토큰 수를 돌려준다.
+        extra_tokens = ContextWindow.count_tokens({'role': 'developer', 'content': extra_instruction})
+        if not self._is_over_token_limit(extra_tokens):
+            return extra_tokens
+        summary_reserve = 0 if self.context.has_summary() else self.summary_max_tokens
+        budget = self.max_token_size - self.instruction_tokens - extra_tokens - summary_reserve
+        evicted = self.context.evict_oldest(int(budget * self.eviction_ratio), self.keep_recent)
+        if not evicted:
+            return extra_tokens
+
+        # 아직 DB에 저장되지 않은 메시지는 컨텍스트에서 빠지기 전에 저장
+        self.memoryManager.save_chat([m for m in evicted if not m.get('saved', False)])
+
+        topics = self.memoryManager.summarize(evicted)
+        if topics:
+            self.summary_topics.extend(topics)
+            summary = self._render_summary()
+            while (ContextWindow.count_tokens({'role': 'developer', 'content': summary}) > self.summary_max_tokens
+                   and len(self.summary_topics) > 1):
+                self.summary_topics.pop(0)
+                summary = self._render_summary()
+            self.context.set_summary(summary)
+            print(f'> fit_context: {len(evicted)}개 메시지를 요약으로 접음, 현재 토큰 {self.context.total_tokens}')
+        else:
+            # 요약에 실패하면 밀려난 대화를 통째로 버리지 않고, 예산 안에 들어가는 최근 것부터 원문으로 되돌린다
+            restored = self.context.restore_evicted(evicted, self.max_token_size - self.instruction_tokens - extra_tokens)
+            print(f'> fit_context: 요약 실패, {len(evicted) - restored}개 메시지를 요약 없이 잘라냄 '
+                  f'(원문 {restored}개 유지), 현재 토큰 {self.context.total_tokens}')
+        # 서버 쪽 체인에는 밀려난 원문이 그대로 남아 있으므로 다음 요청은 전체 컨텍스트로 보낸다
+        self.reset_chain()
+        return extra_tokens
+
+    def _render_summary(self):
+        lines = ['[이전 대화 요약] 아래는 이번 대화에서 앞서 나눈 내용의 요약이다. 필요할 때 자연스럽게 참고하라.']
+        lines += [f"- {topic['주제']}: {topic['요약']}" for topic in self.summary_topics]
+        return '\n'.join(lines)
+
+    def _makeup(self, message, stream):
+        return makeup_stream(message) if stream else makeup_response(message)
+
+    def _send_request(self, extra_instruction: str = "", stream=False):
         try:
-            if self._is_over_token_limit():
+            extra_tokens = self.fit_context(extra_instruction)
+            # 기억 지시문까지는 못 넣지만 대화만으로는 들어가면 지시문을 빼고 보낸다
+            if self._is_over_token_limit(extra_tokens) and not self._is_over_token_limit():
+                print(f'> 기억 지시문({extra_tokens} 토큰)이 예산을 넘어 빼고 보냄')
+                extra_instruction, extra_tokens = '', 0
+            # 최근 메시지만으로도 예산을 넘으면(메시지 하나가 너무 긴 경우) 거절
+            if self._is_over_token_limit(extra_tokens):
                 if self.context:
                     self.context.pop()
-                return makeup_response('메시지를 조금 짧게 보내줄래?')
+                return self._makeup('메시지를 조금 짧게 보내줄래?', stream)
 
                 # 기본 instruction + 메모리 지시문
             instructions = self.instruction + extra_instruction
-            print("> new_instructions: :",instructions)
 
-            response = client.responses.create(
-                model=self.model,
-                instructions=instructions,
-                input=self.to_openai_context()
-            )
-            return response
+            try:
+                return self._create_response(instructions, stream)
+            except Exception as e:
+                if self.previous_response_id is None:
+                    raise
+                # 이전 응답을 서버에서 찾지 못하는 등 체인 요청이 실패하면 전체 컨텍스트로 한 번 더 보낸다
+                print(f'> chain 실패({type(e)}), 전체 컨텍스트로 재요청:{e}')
+                self.reset_chain()
+                return self._create_response(instructions, stream)
 
         except Exception as e:
             print(f'> Exception 오류({type(e)}) 발생:{e} ')
-            return makeup_response('[내 챗봇에 문제가 발생했습니다. 잠시 뒤 이용해주세요]')
+            return self._makeup('[내 챗봇에 문제가 발생했습니다. 잠시 뒤 이용해주세요]', stream)
+
+    def _create_response(self, instructions, stream):
+        # instructions는 체인으로 이어지지 않으므로 매 턴 다시 보낸다
+        chained = self.chaining and self.previous_response_id is not None
+        pending = [m for m in self.context if not m.get('chained', False)] if chained else list(self.context)
+        request = {
+            'model': self.model,
+            'instructions': instructions,
+            'input': [{'role': m['role'], 'content': m['content']} for m in pending],
+            'stream': stream,
+        }
+        if chained:
+            request['previous_response_id'] = self.previous_response_id
+        sent_tokens = sum(ContextWindow.count_tokens(m) for m in pending)
+        self.reply_chained = False
+        span = tracer.start_span('main_call', mode='chained' if chained else 'full',
+                                 sent_tokens=sent_tokens, instruction_chars=len(instructions))
+
+        def complete(response):
+            span.record_usage(response)
+            span.outcome = 'ok'
+            self._complete_chain(response, pending, chained, sent_tokens)
+
+        try:
+            response = client.responses.create(**request)
+        except Exception:
+            span.end('error')
+            raise
+        if stream:
+            # 스트림을 끝까지 받아 response.completed가 오면 ok, 중간에 끊기면 incomplete
+            span.outcome = 'incomplete'
+            return stream_text(response, '[내 챗봇에 문제가 발생했습니다. 잠시 뒤 이용해주세요]',
+                               on_complete=complete, on_finish=span.end)
+        complete(response)
+        span.end()
+        return response
+
+    def _complete_chain(self, response, pending, chained, sent_tokens):
+        # 응답이 끝까지 완성된 경우에만 체인을 전진시킨다 (중간에 실패하면 다음 턴에 다시 보낸다)
+        for m in pending:
+            m['chained'] = True
+        self.previous_response_id = response.id
+        self.reply_chained = True
+
+        usage = getattr(response, 'usage', None)
+        details = getattr(usage, 'input_tokens_details', None)
+        record = {
+            'mode': 'chained' if chained else 'full',
+            'sent_messages': len(pending),
+            'sent_tokens': sent_tokens,                              # 로컬에서 센 이번 요청의 input 토큰
+            'input_tokens': getattr(usage, 'input_tokens', None),    # API가 보고한 입력 토큰 (체인 포함)
+            'cached_tokens': getattr(details, 'cached_tokens', None),
+        }
+        self.turn_usage.append(record)
+        print(f'> turn usage: {record}')
+
+    def reset_chain(self):
+        self.previous_response_id = None
+        for m in self.context:
+            m.pop('chained', None)
+
+    def usage_stats(self):
+        stats = {}
+        for mode in ('full', 'chained'):
+            records = [r for r in self.turn_usage if r['mode'] == mode]
+            stats[mode] = {
+                'turns': len(records),
+                'avg_sent_tokens': sum(r['sent_tokens'] for r in records) / len(records) if records else 0,
+                'avg_input_tokens': sum(r['input_tokens'] or 0 for r in records) / len(records) if records else 0,
+                'avg_cached_tokens': sum(r['cached_tokens'] or 0 for r in records) / len(records) if records else 0,
+            }
+        return stats
 
     def retrieve_memory(self):
         user_message = self.context[-1]['content']
@@ -74,29 +213,57 @@ class Chatbot:
             return memory
         else:
             return '[NO_MEMORY_FOUND]'
-    def send_request(self):
-        try:
-            if not getattr(self, "warningAgent", None):
-                self.warningAgent = self._create_warning_agent()
 
-            extra_instruction = ""
+    # 사전 단계를 백그라운드에서 시작한다. 결과는 send_request(prepared=...)로 넘긴다.
+    def prepare_request(self):
+        if not getattr(self, "warningAgent", None):
+            self.warningAgent = self._create_warning_agent()
 
-            if getattr(self, "memoryManager", None):
-                mem = self.retrieve_memory()
+        user_message = self.context[-1]['content']
+        # 도구 경로로 빠지면 cancel_prepared가 세우는 플래그. 아직 시작 안 한 단계는 건너뛴다
+        cancelled = threading.Event()
+
+        def submit(fn, *args):
+            # tracer.bind로 감싸 풀 스레드에서 연 span도 이번 턴의 트레이스에 들어가게 한다
+            run = tracer.bind(fn)
+            return pipeline_executor.submit(lambda: None if cancelled.is_set() else run(*args))
 
-                if mem is not None:
-                    if mem == "[NO_MEMORY_FOUND]":
-                        # 기억 못 찾은 경우
-                        extra_instruction += """\n
+        # 벡터 검색(임베딩 + Pinecone)은 회상 표현이 있을 때만 미리 돌리고(추측 실행),
+        # 나머지는 기억이 필요하다고 판정된 뒤에 검색한다
+        search_future = None
+        if memory_gate.has_recall_cue(user_message):
+            search_future = submit(self.memoryManager.search_memory_candidates, user_message, cancelled)
+        return (
+            submit(self.warningAgent.monitor_user, self.to_openai_context()),
+            submit(self.memoryManager.needs_memory, user_message),
+            search_future,
+            cancelled,
+        )
+
+    def cancel_prepared(self, prepared):
+        # 도구 호출로 답하게 되어 사전 단계 결과가 필요 없으면 남은 작업을 멈춘다
+        if prepared is None:
+            return
+        *futures, cancelled = prepared
+        cancelled.set()
+        for future in futures:
+            if future is not None:
+                future.cancel()
+
+    def _memory_instruction(self, mem):
+        if mem is None:
+            return ""
+        if mem == "[NO_MEMORY_FOUND]":
+            # 기억 못 찾은 경우
+            return """\n
             [기억 관련 지시]
             이번 사용자의 질문과 연관된 과거 대화를 벡터 DB에서 찾지 못했다.
             만약 사용자가 "예전에 말해줬잖아?"처럼 과거 대화를 기대하는 뉘앙스를 보였다면,
             정확한 내용을 기억하지 못한다고 솔직하게 말하고,
             다시 상황이나 조건을 설명해달라고 요청하라.
             """
-                    else:
-                        # 기억을 찾은 경우
-                        extra_instruction += f"""\n
+        # 기억을 찾은 경우
+        return f"""\n
             [대화 기억]
             아래는 사용자가 과거에 했던 대화의 요약이다. 이 내용을 현재 질문과 함께 참고해서 자연스럽게 답변하라.
             사용자에게는 "예전에 말했던 것처럼..." 정도로 필요할 때만 간단히 언급하고,
@@ -107,25 +274,71 @@ class Chatbot:
             --------------------
             """
 
+    # stream=True면 응답 대신 텍스트 조각을 내보내는 제너레이터를 돌려준다
+    def send_request(self, prepared=None, stream=False):
+        if self.concurrent or prepared is not None:
+            return self._send_request_concurrently(prepared, stream)
+        return self._send_request_serially(stream)
+
+    def _send_request_concurrently(self, prepared=None, stream=False):
+        try:
+            if prepared is None:
+                prepared = self.prepare_request()
+            monitor_future, needs_memory_future, search_future, _ = prepared
+
+            # 안전성 점검 결과가 먼저 나오면 기억 조회를 기다리지 않고 바로 경고
+            if monitor_future.result():
+                return self._makeup(self.warningAgent.warn_user(), stream)
+
+            mem = None
+            if needs_memory_future.result():
+                user_message = self.context[-1]['content']
+                searched = (search_future.result() if search_future is not None
+                            else self.memoryManager.search_memory_candidates(user_message))
+                memory = self.memoryManager.resolve_memory(user_message, searched)
+                mem = memory if memory is not None else '[NO_MEMORY_FOUND]'
+
+            return self._send_request(extra_instruction=self._memory_instruction(mem), stream=stream)
+
+        except Exception as e:
+            print(f'> Exception 오류({type(e)}) 발생:{e} ')
+            return self._makeup('[내 챗봇에 문제가 발생했습니다. 잠시 뒤 이용해주세요]', stream)
+
+    def _send_request_serially(self, stream=False):
+        try:
+            if not getattr(self, "warningAgent", None):
+                self.warningAgent = self._create_warning_agent()
+
+            extra_instruction = ""
+
+            if getattr(self, "memoryManager", None):
+                extra_instruction += self._memory_instruction(self.retrieve_memory())
+
             #전체 컨텍스트 기반 안전성 점검
             if self.warningAgent.monitor_user(self.to_openai_context()):
-                return makeup_response(self.warningAgent.warn_user())
-
-            response = self._send_request(extra_instruction=extra_instruction)
+                return self._makeup(self.warningAgent.warn_user(), stream)
 
-            self.handle_token_limit(response)
-            return response
+            return self._send_request(extra_instruction=extra_instruction, stream=stream)
 
         except Exception as e:
             print(f'> Exception 오류({type(e)}) 발생:{e} ')
-            return makeup_response('[내 챗봇에 문제가 발생했습니다. 잠시 뒤 이용해주세요]')
+            return self._makeup('[내 챗봇에 문제가 발생했습니다. 잠시 뒤 이용해주세요]', stream)
 
     def add_response(self, response):
+        # 스트리밍이 끝나면 조립된 답변 문자열이 그대로 들어온다
+        if isinstance(response, str):
+            role, content = 'assistant', response
+        else:
+            role, content = response.output[-1].role, response.output_text
+        # 체인 요청으로 받은 답변은 이미 서버에 있으므로 다음 턴에 다시 보내지 않는다.
+        # 도구 호출 경로나 경고 문구처럼 체인 밖에서 만든 답변은 다음 턴에 새 메시지와 함께 보낸다.
         self.context.append({
-            'role': response.output[-1].role,
-            'content': response.output_text,
-            'saved': False
+            'role': role,
+            'content': content,
+            'saved': False,
+            'chained': self.reply_chained,
         })
+        self.reply_chained = False
 
     def get_last_response(self):
         return self.context[-1]['content']
@@ -134,15 +347,8 @@ class Chatbot:
         return [{'role': v['role'], 'content': v['content']} for v in self.context]
 
     def save_chat(self):
-        self.memoryManager.save_chat(self.context)
-
-    def handle_token_limit(self, response):
-        try:
-            if response['usage']['total_tokens'] > self.max_token_size:
-                remove_size = math.ceil(len(self.context) / 10)
-                self.context = [self.context[0]] + self.context[remove_size+1:]
-        except Exception as e:
-            print(f'> handle_token_limit exception:{e}')
+        with tracer.span('save'):
+            self.memoryManager.save_chat(self.context)
 
     def _create_warning_agent(self):
         return WarningAgent(
@@ -1,5 +1,5 @@
 import os
-from openai import OpenAI
+import threading
 from dataclasses import dataclass
 import pytz
 from datetime import datetime, timedelta
@@ -13,24 +13,84 @@ class Model:
 
 model = Model()
 
-client = OpenAI(
-    api_key=os.getenv("OPENAI_API_KEY"),
-    timeout=30,
-    max_retries=1
-)
 
+class Lazy:
+    # 외부 클라이언트처럼 만들기 비싼 객체를 처음 쓸 때 만든다.
+    # 모듈을 임포트하는 것만으로는 연결/인증/무거운 패키지 로드가 일어나지 않고,
+    # 속성 접근(client.responses...)은 그대로 실제 객체로 넘어간다.
 
-import tiktoken
+    def __init__(self, factory):
+        self._factory = factory
+        self._instance = None
+        self._lock = threading.Lock()
+
+    def get_instance(self):
+        if self._instance is None:
+            with self._lock:
+                if self._instance is None:
+                    self._instance = self._factory()
+        return self._instance
+
+    def __getattr__(self, name):
+        return getattr(self.get_instance(), name)
+
+    def __getitem__(self, key):
+        return self.get_instance()[key]
+
+
+def _create_client():
+    from openai import OpenAI
+    return OpenAI(
+        api_key=os.getenv("OPENAI_API_KEY"),
+        timeout=30,
+        max_retries=1
+    )
+
+
+def _create_async_client():
+    # 오프라인 데이터 생성 스크립트(pipeline_runner)용. 재시도는 러너가 직접 하므로 max_retries=0
+    from openai import AsyncOpenAI
+    return AsyncOpenAI(
+        api_key=os.getenv("OPENAI_API_KEY"),
+        timeout=120,
+        max_retries=0
+    )
+
+
+client = Lazy(_create_client)
+async_client = Lazy(_create_async_client)
+
+
+from functools import lru_cache
+
+TOKENS_PER_MESSAGE = 3    # 모든 메시지는 다음 형식을 따른다: <|start|>{role/name}\n{content}<|end|>\n
+TOKENS_PER_REPLY = 3      # 모든 메시지는 다음 형식으로 assistant의 답변을 준비한다: <|start|>assistant<|message|>
+
+
+@lru_cache(maxsize=None)
+def get_encoding(model='gpt-4o'):
+    # 인코더는 처음 토큰을 셀 때 프로세스당 모델별로 한 번만 로드한다
+    import tiktoken
+    return tiktoken.encoding_for_model(model)
+
+def message_num_tokens(message, model='gpt-4o'):
+    encoding = get_encoding(model)
+    num_tokens = TOKENS_PER_MESSAGE
+    for _, value in message.items():
+        num_tokens += len(encoding.encode(value))
+    return num_tokens
+
+def text_num_tokens(text, model='gpt-4o'):
+    try:
+        return len(get_encoding(model).encode(text))
+    except Exception:
+        return len(text)    # 인코더를 못 불러오면 글자 수로 보수적으로 추정
 
 def gpt_num_tokens(messages, model='gpt-4o'):
-    encoding = tiktoken.encoding_for_model(model)
-    tokens_per_message = 3    # 모든 메시지는 다음 형식을 따른다: <|start|>{role/name}\n{content}<|end|>\n
     num_tokens = 0
     for message in messages:
-        num_tokens += tokens_per_message
-        for _, value in message.items():
-            num_tokens += len(encoding.encode(value))
-    num_tokens += 3    # 모든 메시지는 다음 형식으로 assistant의 답변을 준비한다: <|start|>assistant<|message|>
+        num_tokens += message_num_tokens(message, model)
+    num_tokens += TOKENS_PER_REPLY
     return num_tokens
 
 
@@ -56,6 +116,48 @@ def makeup_response(message):
     ns = dict_to_namespace(data)
     return ns
 
+def makeup_stream(message):
+    # 스트리밍 모드에서 고정 문구(경고, 오류 안내)를 한 조각짜리 스트림으로 돌려준다
+    yield message
+
+class TextStream:
+    # Responses API 스트림 이벤트 중 텍스트 조각(delta)만 순서대로 흘려보낸다.
+    # on_complete가 있으면 스트림이 정상 종료될 때 완성된 응답 객체(id, usage 포함)를 넘겨주고,
+    # on_finish는 성공/실패와 상관없이 스트림이 끝나거나 닫힐 때 부른다.
+    # 중간에 실패하면 error_message를 화면용 마지막 조각으로 내보내고 failed=True로 표시한다.
+    # 받은 답변(text)에는 오류 문구가 섞이지 않으므로, 호출한 쪽은 failed를 보고 저장하지 않는다.
+
+    def __init__(self, events, error_message, on_complete=None, on_finish=None):
+        self.events = events
+        self.error_message = error_message
+        self.on_complete = on_complete
+        self.on_finish = on_finish
+        self.parts = []
+        self.failed = False
+
+    def __iter__(self):
+        try:
+            for event in self.events:
+                if event.type == 'response.output_text.delta':
+                    self.parts.append(event.delta)
+                    yield event.delta
+                elif event.type == 'response.completed' and self.on_complete is not None:
+                    self.on_complete(event.response)
+        except Exception as e:
+            print(f'> stream Exception 오류({type(e)}) 발생:{e} ')
+            self.failed = True
+            yield ('\n\n' if self.parts else '') + self.error_message
+        finally:
+            if self.on_finish is not None:
+                self.on_finish()
+
+    @property
+    def text(self):
+        return ''.join(self.parts)
+
+def stream_text(events, error_message, on_complete=None, on_finish=None):
+    return TextStream(events, error_message, on_complete, on_finish)
+
 def today():
     korea = pytz.timezone('Asia/Seoul')  # 한국 시간대를 얻습니다.
     now = datetime.now(korea)            # 현재 시각을 얻습니다.
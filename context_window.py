@@ -0,0 +1,86 @@
+from common import message_num_tokens, TOKENS_PER_MESSAGE, TOKENS_PER_REPLY
+
+
+class ContextWindow:
+    # 대화 컨텍스트(메시지 목록)와 그 토큰 수 합계를 함께 관리한다.
+    # 메시지별 토큰 수는 들어올 때 한 번만 세어 'tokens' 키에 캐시하고,
+    # 합계는 추가/삭제 시 O(1)로 갱신하므로 매 턴 전체를 다시 인코딩하지 않는다.
+
+    def __init__(self, messages=()):
+        self.messages = []
+        self.total_tokens = TOKENS_PER_REPLY
+        self.extend(messages)
+
+    @staticmethod
+    def count_tokens(message):
+        if 'tokens' not in message:
+            try:
+                message['tokens'] = message_num_tokens(
+                    {'role': message['role'], 'content': message['content']}
+                )
+            except Exception as e:
+                # 인코더를 못 불러오면(오프라인 등) 글자 수로 보수적으로 추정
+                print(f'> count_tokens exception:{e}')
+                message['tokens'] = TOKENS_PER_MESSAGE + len(message['role']) + len(message['content'])
+        return message['tokens']
+
+    def append(self, message):
+        self.total_tokens += self.count_tokens(message)
+        self.messages.append(message)
+
+    def extend(self, messages):
+        for message in messages:
+            self.append(message)
+
+    def has_summary(self):
+        return len(self.messages) > 1 and self.messages[1].get('summary', False)
+
+    def set_summary(self, content):
+        # 밀려난 대화의 누적 요약은 개발자 프롬프트 바로 뒤에 고정한다 (DB에는 저장하지 않음)
+        message = {'role': 'developer', 'content': content, 'saved': True, 'summary': True}
+        if self.has_summary():
+            self.pop(1)
+        self.total_tokens += self.count_tokens(message)
+        self.messages.insert(1, message)
+
+    def evict_oldest(self, target_tokens, keep_recent):
+        # 고정 메시지(개발자 프롬프트, 요약) 다음의 가장 오래된 메시지부터
+        # 합계가 target_tokens 이하가 될 때까지 빼낸다. 최근 keep_recent개는 원문 그대로 둔다.
+        start = 2 if self.has_summary() else 1
+        evicted = []
+        while self.total_tokens > target_tokens and len(self.messages) - start > keep_recent:
+            evicted.append(self.pop(start))
+        return evicted
+
+    def restore_evicted(self, evicted, max_tokens):
+        # evict_oldest로 빼낸 메시지를 최근 것부터 합계가 max_tokens를 넘지 않는 만큼 원래 자리에 되돌린다.
+        # 되돌린 개수를 돌려준다 (나머지는 잘려 나간다)
+        start = 2 if self.has_summary() else 1
+        restored = 0
+        for message in reversed(evicted):
+            if self.total_tokens + message['tokens'] > max_tokens:
+                break
+            self.total_tokens += message['tokens']
+            self.messages.insert(start, message)
+            restored += 1
+        return restored
+
+    def pop(self, index=-1):
+        message = self.messages.pop(index)
+        self.total_tokens -= message['tokens']
+        return message
+
+    def __delitem__(self, index):
+        removed = self.messages[index]
+        for message in (removed if isinstance(index, slice) else [removed]):
+            self.total_tokens -= message['tokens']
+        del self.messages[index]
+
+    def __getitem__(self, index):
+        return self.messages[index]
+
+    def __iter__(self):
+        return iter(self.messages)
+
+    def __len__(self):
+        return len(self.messages)
@@ -0,0 +1,189 @@
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+from array import array
+from collections import OrderedDict
+from common import client, Lazy
+from tracing import tracer
+
+embedding_model = "text-embedding-ada-002"
+EMBEDDING_BATCH_SIZE = 256   # 임베딩 요청 1회당 최대 입력 수
+
+# Streamlit 재시작 후에도 유지되도록 디스크(SQLite)에 둔다
+EMBEDDING_CACHE_PATH = os.getenv(
+    'EMBEDDING_CACHE_PATH',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache', 'embeddings.sqlite3')
+)
+
+
+class EmbeddingCache:
+    # (모델 + 텍스트) 해시를 키로 하는 2단 임베딩 캐시
+    # 1단: 프로세스 메모리 LRU, 2단: SQLite 파일 (float32 BLOB, 마지막 접근 시각 기준 용량 제한)
+
+    def __init__(self, path=EMBEDDING_CACHE_PATH, memory_size=2048, disk_max_bytes=256 * 1024 * 1024):
+        self.memory = OrderedDict()
+        self.memory_size = memory_size
+        self.disk_max_bytes = disk_max_bytes
+        self.lock = threading.Lock()
+        self.hits = {'memory': 0, 'disk': 0}
+        self.misses = 0
+        self.inflight = {}   # 다른 스레드가 지금 요청 중인 key -> 끝나면 set되는 Event
+        self.shared = 0      # 진행 중인 요청을 기다려 받은 횟수
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute(
+            'CREATE TABLE IF NOT EXISTS embeddings ('
+            'key TEXT PRIMARY KEY, model TEXT, vector BLOB, size INTEGER, last_access REAL)'
+        )
+        self.db.execute('CREATE INDEX IF NOT EXISTS embeddings_last_access ON embeddings(last_access)')
+        self.db.commit()
+        self.disk_bytes = self.db.execute('SELECT COALESCE(SUM(size), 0) FROM embeddings').fetchone()[0]
+
+    @staticmethod
+    def make_key(text, model):
+        return hashlib.sha256(f'{model}\0{text}'.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        with self.lock:
+            if key in self.memory:
+                self.memory.move_to_end(key)
+                self.hits['memory'] += 1
+                return self.memory[key]
+
+            row = self.db.execute('SELECT vector FROM embeddings WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.db.execute('UPDATE embeddings SET last_access = ? WHERE key = ?', (time.time(), key))
+            self.db.commit()
+            vector = array('f', row[0]).tolist()
+            self.hits['disk'] += 1
+            self._remember(key, vector)
+            return vector
+
+    def put(self, key, model, vector):
+        blob = array('f', vector).tobytes()
+        with self.lock:
+            self._remember(key, vector)
+            old = self.db.execute('SELECT size FROM embeddings WHERE key = ?', (key,)).fetchone()
+            self.db.execute(
+                'INSERT OR REPLACE INTO embeddings (key, model, vector, size, last_access) VALUES (?, ?, ?, ?, ?)',
+                (key, model, blob, len(blob), time.time())
+            )
+            self.disk_bytes += len(blob) - (old[0] if old else 0)
+            self._evict_disk()
+            self.db.commit()
+
+    def _remember(self, key, vector):
+        self.memory[key] = vector
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.memory_size:
+            self.memory.popitem(last=False)
+
+    def _evict_disk(self):
+        # 용량을 넘으면 가장 오래 안 쓴 항목부터 90%까지 지운다
+        if self.disk_bytes <= self.disk_max_bytes:
+            return
+        target = int(self.disk_max_bytes * 0.9)
+        rows = self.db.execute('SELECT key, size FROM embeddings ORDER BY last_access').fetchall()
+        evicted = []
+        for key, size in rows:
+            if self.disk_bytes <= target:
+                break
+            evicted.append((key,))
+            self.disk_bytes -= size
+        self.db.executemany('DELETE FROM embeddings WHERE key = ?', evicted)
+
+    def embed(self, texts, model=embedding_model):
+        # 캐시에 없는 텍스트만 모아 EMBEDDING_BATCH_SIZE개씩 묶어서 요청한다.
+        # 같은 텍스트를 다른 스레드가 이미 요청 중이면(한 턴의 기억 판정과 벡터 검색 등) 그 결과를 기다려 쓴다.
+        with tracer.span('embed', texts=len(texts)) as span:
+            keys = [self.make_key(text, model) for text in texts]
+            vectors = [self.get(key) for key in keys]
+
+            missing = {}
+            for text, key, vector in zip(texts, keys, vectors):
+                if vector is None:
+                    missing.setdefault(key, text)
+            span.set(misses=len(missing))
+            if missing:
+                owned, waiting = self._claim(missing)
+                fetched = {}
+                try:
+                    self._fetch(owned, model, fetched, span)
+                finally:
+                    self._release(owned)
+                retry = {}
+                for key, event in waiting.items():
+                    event.wait()
+                    vector = self.get(key)
+                    if vector is None:
+                        retry[key] = missing[key]   # 먼저 요청한 스레드가 실패했으면 직접 요청
+                    else:
+                        fetched[key] = vector
+                self._fetch(retry, model, fetched, span)
+                span.set(shared=len(waiting) - len(retry))
+                vectors = [vector if vector is not None else fetched[key] for key, vector in zip(keys, vectors)]
+        return vectors
+
+    def _claim(self, missing):
+        # 아무도 요청하지 않은 key는 이 스레드가 맡고, 요청 중인 key는 기다릴 Event를 받는다
+        owned, waiting = {}, {}
+        with self.lock:
+            for key, text in missing.items():
+                event = self.inflight.get(key)
+                if event is None and key in self.memory:
+                    # 조회와 이 사이에 다른 스레드가 받아 둔 경우
+                    event = threading.Event()
+                    event.set()
+                if event is None:
+                    self.inflight[key] = threading.Event()
+                    owned[key] = text
+                else:
+                    waiting[key] = event
+                    self.shared += 1
+        return owned, waiting
+
+    def _release(self, owned):
+        with self.lock:
+            for key in owned:
+                self.inflight.pop(key).set()
+
+    def _fetch(self, texts_by_key, model, fetched, span):
+        keys = list(texts_by_key.keys())
+        for start in range(0, len(keys), EMBEDDING_BATCH_SIZE):
+            batch = keys[start:start + EMBEDDING_BATCH_SIZE]
+            response = client.embeddings.create(input=[texts_by_key[key] for key in batch], model=model)
+            span.record_usage(response)
+            for key, item in zip(batch, sorted(response.data, key=lambda d: d.index)):
+                fetched[key] = item.embedding
+                self.put(key, model, item.embedding)
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits['memory'] + self.hits['disk'] + self.misses
+            return {
+                'memory_hits': self.hits['memory'],
+                'disk_hits': self.hits['disk'],
+                'misses': self.misses,
+                'shared': self.shared,
+                'hit_rate': (lookups - self.misses) / lookups if lookups else 0.0,
+                'memory_entries': len(self.memory),
+                'disk_bytes': self.disk_bytes,
+            }
+
+
+# SQLite 파일은 처음 임베딩을 찾을 때 연다
+embedding_cache = Lazy(EmbeddingCache)
+
+
+def get_embeddings(texts, model=embedding_model):
+    return embedding_cache.embed(list(texts), model)
+
+
+def get_embedding(text, model=embedding_model):
+    return embedding_cache.embed([text], model)[0]
@@ -0,0 +1,85 @@
+import json
+import sys
+from memory_gate import MemoryGate
+from memory_manager import MemoryManager
+
+# 대화원천내용.json의 사용자(민수) 발화로 로컬 게이트와 기존 LLM 분류기(gpt-5)의 일치도를 재고,
+# LLM 판정과 TARGET_AGREEMENT 이상 일치하면서 로컬 판정이 가장 많아지는 경계(margin)를 권장값으로 출력한다.
+# 사용법: python evaluate_memory_gate.py [목표 일치율(기본 0.95)]
+
+TARGET_AGREEMENT = 0.95
+
+
+def agreement(pairs, expected):
+    return sum(1 for reference in pairs if reference == expected) / len(pairs) if pairs else 1.0
+
+
+def best_positive_margin(rows, target):
+    # 회상 표현이 있는 발화 중 margin > 경계인 것을 True로 확정할 때, 일치율을 지키는 가장 낮은 경계
+    candidates = sorted({margin for has_cue, margin, _ in rows if has_cue}, reverse=True)
+    best = None
+    for threshold in candidates:
+        boundary = threshold - 1e-6
+        decided = [reference for has_cue, margin, reference in rows if has_cue and margin > boundary]
+        if agreement(decided, True) < target:
+            break
+        best = (round(boundary, 4), len(decided), agreement(decided, True))
+    return best
+
+
+def best_negative_margin(rows, target):
+    # 회상 표현이 없는 발화 중 margin <= 경계인 것을 False로 확정할 때, 일치율을 지키는 가장 높은 경계
+    candidates = sorted({margin for has_cue, margin, _ in rows if not has_cue})
+    best = None
+    for threshold in candidates:
+        decided = [reference for has_cue, margin, reference in rows if not has_cue and margin <= threshold]
+        if agreement(decided, False) < target:
+            break
+        best = (round(threshold, 4), len(decided), agreement(decided, False))
+    return best
+
+
+if __name__ == '__main__':
+    target = float(sys.argv[1]) if len(sys.argv) > 1 else TARGET_AGREEMENT
+
+    with open('대화원천내용.json', 'r', encoding='utf-8') as f:
+        conversations = json.load(f)
+    messages = [turn['민수'] for conversation in conversations for turn in conversation if '민수' in turn]
+
+    gate = MemoryGate()
+    memory_manager = MemoryManager(user='민수', assistant='고비')
+
+    confusion = {(local, reference): 0 for local in (True, False, None) for reference in (True, False)}
+    rows, disagreements = [], []   # rows: [(회상 표현 유무, margin, LLM 판정)]
+    for i, message in enumerate(messages):
+        has_cue, margin = gate.signals(message)
+        local = gate.classify(has_cue, margin, gate.positive_margin, gate.negative_margin)
+        reference = memory_manager.needs_memory_llm(message)
+        confusion[(local, reference)] += 1
+        if margin is not None:
+            rows.append((has_cue, margin, reference))
+        if local is not None and local != reference:
+            disagreements.append((message, local, reference))
+        print(f'{i + 1}/{len(messages)} cue={has_cue} margin={margin} local={local} llm={reference}')
+
+    decided = sum(count for (local, _), count in confusion.items() if local is not None)
+    agreed = sum(count for (local, reference), count in confusion.items() if local == reference)
+
+    print('\n=== memory gate 평가 ===')
+    print(f'메시지 수: {len(messages)} (LLM 판정 True {sum(1 for *_, r in rows if r)}개)')
+    print(f'현재 경계: positive_margin={gate.positive_margin}, negative_margin={gate.negative_margin}')
+    print(f'LLM 생략 비율: {decided / len(messages):.1%} ({decided}/{len(messages)})' if messages else 'LLM 생략 비율: -')
+    print(f'로컬 판정 일치율: {agreed / decided:.1%}' if decided else '로컬 판정 일치율: - (로컬 판정 없음)')
+    print('혼동 행렬 (local, llm): count')
+    for key, count in confusion.items():
+        print(f'  {key}: {count}')
+    for message, local, reference in disagreements:
+        print(f'[불일치] local={local} llm={reference} | {message}')
+
+    positive = best_positive_margin(rows, target)
+    negative = best_negative_margin(rows, target)
+    print(f'\n=== 권장 경계 (목표 일치율 {target:.0%}) ===')
+    print(f'MEMORY_GATE_POSITIVE_MARGIN={positive[0]}  (True 확정 {positive[1]}개, 일치율 {positive[2]:.1%})'
+          if positive else 'MEMORY_GATE_POSITIVE_MARGIN: 목표를 만족하는 경계 없음 (True는 모두 LLM에 맡김)')
+    print(f'MEMORY_GATE_NEGATIVE_MARGIN={negative[0]}  (False 확정 {negative[1]}개, 일치율 {negative[2]:.1%})'
+          if negative else 'MEMORY_GATE_NEGATIVE_MARGIN: 목표를 만족하는 경계 없음 (False는 모두 LLM에 맡김)')
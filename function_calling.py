@@ -1,11 +1,30 @@
 import json
 import requests
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor
 from pprint import pprint
-from common import client, model, makeup_response
-import yfinance as yf
-from tavily import TavilyClient
+from common import client, model, makeup_response, makeup_stream, stream_text, Lazy
+from tool_cache import cached_tool, cache_outcome
+from tracing import tracer
 import os
-tavily = TavilyClient(api_key=os.getenv('TAVILY_API_KEY'))
+
+
+def _create_tavily():
+    from tavily import TavilyClient
+    return TavilyClient(api_key=os.getenv('TAVILY_API_KEY'))
+
+
+# 검색 클라이언트는 처음 검색할 때 만든다 (yfinance/pandas도 주가를 처음 조회할 때 임포트)
+tavily = Lazy(_create_tavily)
+
+# 모든 도구가 함께 쓰는 연결 풀(keep-alive) 세션. 느린 외부 API가 앱 전체를 붙잡지 않도록 타임아웃을 건다.
+HTTP_TIMEOUT = (3.05, 10)   # (connect, read) 초
+SEARCH_TIMEOUT = 15
+http = requests.Session()
+http.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=16))
+
+# 한 응답에서 여러 도구를 요청하면 이 풀에서 동시에 실행한다
+tool_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix='tool')
 
 # 위도 경도
 global_lat_lon = {
@@ -21,9 +40,20 @@ global_lat_lon = {
 # 화폐 코드
 global_currency_code = {'달러': 'USD', '엔화': 'JPY', '유로화': 'EUR', '위안화': 'CNY', '파운드': 'GBP'}
 
+# 도구별 결과 캐시 유지 시간(초)
+WEATHER_TTL = 10 * 60
+CURRENCY_TTL = 60 * 60
+STOCK_TTL = 30
+SEARCH_TTL = 15 * 60
 
+
+def _normalize_text(value):
+    return ' '.join(str(value).split()).lower()
+
+
+@cached_tool('get_celsius_temperature', WEATHER_TTL, key=lambda kwargs: kwargs['location'].strip())
 def get_celsius_temperature(**kwargs):
-    location = kwargs['location']
+    location = kwargs['location'].strip()
     lat_lon = global_lat_lon.get(location, None)
     if lat_lon is None:
         return None
@@ -34,7 +64,7 @@ def get_celsius_temperature(**kwargs):
     url = f'https://api.open-meteo.com/v1/forecast?latitude={lat}&longitude={lon}&current_weather=true'
 
     # API를 호출하여 데이터 가져오기
-    response = requests.get(url)
+    response = http.get(url, timeout=HTTP_TIMEOUT)
     # 응답을 JSON 형태로 변환
     data = response.json()
     # 현재 온도 가져오기 (섭씨)
@@ -44,25 +74,34 @@ def get_celsius_temperature(**kwargs):
     return temperature
 
 
+@cached_tool('exchange_rates', CURRENCY_TTL, key=lambda kwargs: 'USD')
+def get_exchange_rates():
+    # USD 기준 환율표 하나를 받아 두고 모든 통화쌍을 여기서 계산한다
+    response = http.get('https://api.exchangerate-api.com/v4/latest/USD', timeout=HTTP_TIMEOUT)
+    return response.json()['rates']
+
+
 def get_currency(**kwargs):
     currency_name = kwargs['currency_name']
-    currency_name = currency_name.replace('환율', '')
+    currency_name = currency_name.replace('환율', '').strip()
     currency_code = global_currency_code.get(currency_name, 'USD')
 
     if currency_code is None:
         return None
 
-    response = requests.get(f'https://api.exchangerate-api.com/v4/latest/{currency_code}')
-    data = response.json()
-    krw = data['rates']['KRW']
+    rates = get_exchange_rates()
+    krw = round(rates['KRW'] / rates[currency_code], 4)    # 1 {currency_code} = krw 원
 
     print('> 환율:', krw)
     return krw
 
 
+@cached_tool('get_stock_price', STOCK_TTL, key=lambda kwargs: kwargs['ticker'].upper().strip(),
+             cacheable=lambda value: not value.startswith('[ERROR'))
 def get_stock_price(**kwargs):
     ticker = kwargs['ticker'].upper().strip()
     try:
+        import yfinance as yf
         tk = yf.Ticker(ticker)
 
         info = getattr(tk, 'fast_info', {}) or {}
@@ -84,9 +123,10 @@ def get_stock_price(**kwargs):
     except Exception as e:
         return f"[ERROR:get_stock_price] {ticker} 조회 실패 - {type(e).__name__}: {e}"
 
+@cached_tool('search_internet', SEARCH_TTL, key=lambda kwargs: _normalize_text(kwargs['search_query']))
 def search_internet(**kwargs):
     print("search_internet", kwargs)
-    answer = tavily.search(query=kwargs['search_query'], include_answer=True)['answer']
+    answer = tavily.search(query=kwargs['search_query'], include_answer=True, timeout=SEARCH_TIMEOUT)['answer']
     print("answer: ", answer)
     return answer
 
@@ -164,20 +204,109 @@ class FunctionCalling:
 
 
     def analyze(self, user_message, tools):
+        with tracer.span("analyze") as span:
+            try:
+                response = client.responses.create(
+                    model=self.model,
+                    input=[{"role": "user", "content": user_message}],
+                    tools=tools,
+                    tool_choice="auto"
+                )
+                span.record_usage(response)
+                span.set(tool_calls=sum(getattr(item, "type", None) == "function_call" for item in response.output))
+                return response, "function_call"
+            except Exception as e:
+                print("Error occurred(analyze):", e)
+                span.outcome = "error"
+                return makeup_response("[analyze 오류입니다]"), "error"
+
+
+    # analyze 결과에서 요청된 도구 호출만 [(함수 이름, 인자 dict), ...] 로 뽑는다
+    def analyze_calls(self, user_message, tools=tools):
+        response, _ = self.analyze(user_message, tools)
+        return [
+            (item.name, json.loads(getattr(item, "arguments", "{}") or "{}"))
+            for item in response.output
+            if getattr(item, "type", None) == "function_call"
+        ]
+
+    def _call_tool(self, call):
+        func_name = getattr(call, "name", None) or getattr(call.function, "name", None)
+        func_args_json = getattr(call, "arguments", "{}") or "{}"
+        return {
+            "type": "function_call_output",
+            "call_id": call.call_id,
+            "output": self._execute(func_name, func_args_json)
+        }
+
+    def _execute(self, func_name, func_args_json):
+        func_to_call = self.available_functions.get(func_name)
+        with tracer.span(f"tool:{func_name}") as span:
+            cache_outcome.set(None)
+            try:
+                func_args = json.loads(func_args_json)
+                if func_to_call:
+                    func_response = func_to_call(**func_args)
+                else:
+                    func_response = f"[알 수 없는 함수 호출: {func_name}]"
+                    span.outcome = "unknown_tool"
+            except Exception as e:
+                # 도구 하나가 실패해도 나머지 결과로 답할 수 있게 오류를 결과로 돌려준다
+                print(f"Error occurred({func_name}):", e)
+                func_response = f"[ERROR:{func_name}] {type(e).__name__}: {e}"
+                span.outcome = "error"
+            span.set(cache=cache_outcome.get())   # 캐시를 거치지 않은 도구는 None
+        return str(func_response)
+
+    def _final_response(self, stream, **request):
+        # 도구 결과를 붙인 최종 답변 요청 (스트리밍이면 스트림이 끝날 때 span을 닫는다)
+        span = tracer.start_span("main_call", mode="tools")
         try:
-            response = client.responses.create(
-                model=self.model,
-                input=[{"role": "user", "content": user_message}],
-                tools=tools,
-                tool_choice="auto"
+            final_response = client.responses.create(model=self.model, instructions=self.instruction,
+                                                     stream=stream, **request)
+        except Exception:
+            span.end("error")
+            raise
+        if stream:
+            span.outcome = "incomplete"
+
+            def complete(response):
+                span.record_usage(response)
+                span.outcome = "ok"
+            return stream_text(final_response, "[run 오류입니다]", on_complete=complete, on_finish=span.end)
+        span.record_usage(final_response)
+        span.end()
+        return final_response
+
+    # 로컬 라우터가 도구와 인자를 확정한 경우: analyze 없이 도구를 바로 실행하고 결과를 붙여 답변을 만든다
+    def run_direct(self, calls, context, stream=False):
+        makeup = makeup_stream if stream else makeup_response
+        try:
+            args_json = [json.dumps(args, ensure_ascii=False) for _, args in calls]
+            outputs = list(tool_executor.map(tracer.bind(self._execute), [name for name, _ in calls], args_json))
+            tool_results = "\n".join(
+                f"- {name}({arguments}): {output}"
+                for (name, _), arguments, output in zip(calls, args_json, outputs)
             )
-            return response, "function_call"
-        except Exception as e:
-            print("Error occurred(analyze):", e)
-            return makeup_response("[analyze 오류입니다]"), "error"
 
+            sanitized_context = [
+                {"role": m["role"], "content": m["content"]}
+                for m in context
+                if "role" in m and "content" in m
+            ]
+            full_input = sanitized_context + [
+                {"role": "developer", "content": f"[도구 실행 결과]\n{tool_results}\n위 결과를 바탕으로 마지막 질문에 답하라."}
+            ]
+
+            return self._final_response(stream, input=full_input)
+
+        except Exception as e:
+            print("Error occurred(run_direct):", e)
+            return makeup("[run 오류입니다]")
 
-    def run(self, previous_response, context):
+    # stream=True면 최종 답변을 텍스트 조각 제너레이터로 돌려준다 (도구 실행은 호출 즉시 끝난다)
+    def run(self, previous_response, context, stream=False):
+        makeup = makeup_stream if stream else makeup_response
         try:
             tool_calls = [
                 item for item in previous_response.output
@@ -185,27 +314,13 @@ class FunctionCalling:
             ]
 
             if not tool_calls:
-                return makeup_response("도구 호출이 없었습니다.")
-
-            # 각 함수 실행 결과를 담을 리스트
-            function_outputs = []
-
-            for call in tool_calls:
-                func_name = getattr(call, "name", None) or getattr(call.function, "name", None)
-                func_to_call = self.available_functions.get(func_name)
-                func_args_json = getattr(call, "arguments", "{}") or "{}"
-                func_args = json.loads(func_args_json)
-
-                if func_to_call:
-                    func_response = func_to_call(**func_args)
-                else:
-                    func_response = f"[알 수 없는 함수 호출: {func_name}]"
+                return makeup("도구 호출이 없었습니다.")
 
-                function_outputs.append({
-                    "type": "function_call_output",
-                    "call_id": call.call_id,
-                    "output": str(func_response)
-                })
+            # 각 함수 실행 결과를 담을 리스트 (여러 개면 동시에 실행하고, 결과는 호출 순서대로 모은다)
+            if len(tool_calls) == 1:
+                function_outputs = [self._call_tool(tool_calls[0])]
+            else:
+                function_outputs = list(tool_executor.map(tracer.bind(self._call_tool), tool_calls))
 
             sanitized_context = [
                 {"role": m["role"], "content": m["content"]}
@@ -215,14 +330,8 @@ class FunctionCalling:
 
             full_input = sanitized_context + function_outputs
 
-            final_response = client.responses.create(
-                model=self.model,
-                input=full_input,
-                previous_response_id=previous_response.id,
-                instructions = self.instruction
-            )
-            return final_response
+            return self._final_response(stream, input=full_input, previous_response_id=previous_response.id)
 
         except Exception as e:
             print("Error occurred(run):", e)
-            return makeup_response("[run 오류입니다]")
+            return makeup("[run 오류입니다]")
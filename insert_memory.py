@@ -1,44 +1,34 @@
-import os
 import json
-from pymongo import MongoClient
-from pinecone.grpc import PineconeGRPC as Pinecone
+import time
 
-from openai import OpenAI
+from embedding_cache import embedding_cache
+from memory_ingest import ingest_memories
+from vector_store import create_vector_store
+from mongo_store import memory_collection, counters_collection
 
-client = OpenAI()
-
-pinecone = Pinecone()
-pinecone_index = pinecone.Index('jjinchin-memory')
-
-mongo_cluster = MongoClient(os.getenv('MONGO_CLUSTER_URI'))
-mongo_memory_collection = mongo_cluster['jjinchin']['memory']
-
-embedding_model = 'text-embedding-ada-002'
+vector_store = create_vector_store(grpc=True)
 
 with open('대화내용요약.json', 'r', encoding='utf-8') as f:
     summaries_list = json.load(f)
 
-mongo_memory_collection.delete_many({})
-
-next_id = 1
+memory_collection.delete_many({})
+counters_collection.delete_one({'_id': 'memory_id'})   # id를 1부터 다시 할당
 
+entries = []
 for list_idx, summaries in enumerate(summaries_list):
     date = f'202511{list_idx + 1:02}'
 
     for summary in summaries:
-        vector = client.embeddings.create(
-            input=summary['요약'],
-            model=embedding_model
-        ).data[0].embedding
-
-        metadata = {'date': date, 'keyword': summary['주제']}
-        upsert_response = pinecone_index.upsert([(str(next_id), vector, metadata)])
-
-        query = {'_id': next_id}
-        newvalues = {'$set': {'date': date, 'keyword': summary['주제'], 'summary': summary['요약']}}
-        mongo_memory_collection.update_one(query, newvalues, upsert=True)
-
-        if (next_id) % 5 == 0:
-            print(f'id: {next_id}')
-
-        next_id += 1
\ No newline at end of file
+        entries.append({'date': date, 'keyword': summary['주제'], 'summary': summary['요약']})
+
+# 임베딩 묶음 요청 + 배치 업서트 + bulk_write 한 번으로 저장
+# 재실행 시에는 디스크 캐시에서 바로 꺼내므로 임베딩 요청이 없다
+start = time.perf_counter()
+ids = ingest_memories(entries, vector_store, memory_collection, counters_collection)
+elapsed = time.perf_counter() - start
+if ids:
+    print(f'id: {ids[0]}~{ids[-1]} ({len(ids)}개, {len(ids) / elapsed:.1f} memories/s)')
+else:
+    print('저장할 기억이 없습니다.')
+
+print('embedding cache:', embedding_cache.stats())
\ No newline at end of file
@@ -0,0 +1,169 @@
+import os
+import re
+import json
+import time
+import random
+import threading
+from dataclasses import dataclass, field
+from common import currTime
+from function_calling import global_lat_lon, global_currency_code
+
+# analyze(LLM) 호출 전에 규칙으로 먼저 판단한다.
+# - 인사/잡담처럼 도구가 필요 없다고 확실하면 'none'  (analyze 생략, 일반 대화로)
+# - 도구와 인자가 분명하면 'tools'                    (analyze 생략, 도구 바로 실행)
+# - 그 밖에는 'llm'                                    (기존처럼 analyze에 맡김)
+
+WEATHER_WORDS = ('날씨', '기온', '온도', '몇 도', '몇도', '더워', '추워', '덥', '춥')
+CURRENCY_WORDS = ('환율',)
+STOCK_WORDS = ('주가', '주식', '시세', '종가', '현재가')
+SEARCH_WORDS = ('검색', '찾아봐', '찾아 봐', '찾아줘', '찾아 줘', '뉴스', '속보', '최신', '실시간', '발표')
+# 도구(특히 검색)가 필요할 수도 있는 시장·시사 표현: 있으면 확신하지 않고 LLM에 맡긴다
+MARKET_WORDS = ('금리', '코스피', '코스닥', '나스닥', '다우', 'S&P', '지수', '유가', '금값', '비트코인', '코인', '물가', '인플레이션')
+
+# 티커는 2~5자 대문자(+거래소 접미사)를 단어 경계로 끊어서 본다 ('I' 같은 한 글자 단어 제외).
+# 한글에 붙은 영문('SK하이닉스', 'LG전자')은 종목명의 일부이므로 티커로 보지 않는다
+TICKER = re.compile(r'(?<![0-9A-Za-z가-힣])(\d{6}\.(?:KS|KQ|ks|kq)|[A-Z]{2,5}(?:\.[A-Z]{1,2})?)(?![0-9A-Za-z가-힣])')
+KRX_TICKER = re.compile(r'^\d{6}\.(?:KS|KQ)$')
+# 대문자 단어만으로 바로 조회해도 되는 티커. 그 밖의 대문자 이름('NAVER', 'POSCO')은 analyze에 맡긴다
+KNOWN_TICKERS = {'AAPL', 'MSFT', 'NVDA', 'TSLA', 'AMZN', 'GOOGL', 'GOOG', 'META', 'NFLX', 'AMD', 'INTC', 'AVGO', 'TSM',
+                 'QCOM', 'ORCL', 'IBM', 'ADBE', 'CRM', 'PLTR', 'COIN', 'UBER', 'DIS', 'NKE', 'SBUX', 'KO', 'PEP', 'MCD',
+                 'WMT', 'COST', 'JPM', 'BAC', 'GS', 'BRK.B', 'SPY', 'QQQ', 'VOO', 'IVV', 'VTI', 'SCHD', 'SOXL', 'TQQQ'}
+NON_TICKERS = {'ETF', 'ISA', 'IRP', 'KRW', 'USD', 'JPY', 'EUR', 'CNY', 'GBP', 'AI', 'IT', 'CEO', 'GDP', 'CPI', 'IPO', 'OK',
+               'PER', 'PBR', 'ROE', 'EPS', 'BPS', 'FED', 'FOMC', 'USA', 'US', 'UK', 'EU', 'TV', 'PC'}
+# 도구가 필요 없는 게 확실한 인사·감사·잡담 표현. 이런 신호가 없으면 도구 신호가 없어도 LLM에 맡긴다
+SMALL_TALK = re.compile(
+    r'^\s*(?:안녕|하이|헬로|반가|고마워|고맙|감사|잘 ?자|잘 ?있어|좋은 아침|굿모닝|ㅎㅇ|ㅋㅋ|ㅎㅎ|ㅠㅠ|그래|알겠|오케이|맞아|(?:응|네|어)(?=[\s.!~]|$))'
+    r'[^?？]{0,20}$'
+)
+EXPLICIT_SEARCH = re.compile(r'\s*(?:을|를)?\s*(?:인터넷에서|인터넷으로)?\s*(?:검색해\s*줘|검색해\s*줄래|검색해봐|검색해\s*봐|찾아\s*줘|찾아\s*봐)\s*[.?!]*\s*$')
+
+
+# 줄임말이 다른 뜻으로 더 자주 쓰이는 지역: '경기'(경기가 안 좋다/축구 경기), '세종'(세종대왕)
+AMBIGUOUS_ALIASES = {'경기', '세종'}
+
+
+def _region_aliases():
+    # '강원도' -> '강원', '제주도' -> '제주' 처럼 줄임말도 같은 지역으로 본다 (뜻이 겹치는 줄임말은 제외)
+    aliases = {}
+    for region in global_lat_lon:
+        aliases[region] = region
+        if len(region) > 2 and region[-1] in ('도', '시') and region[:-1] not in AMBIGUOUS_ALIASES:
+            aliases[region[:-1]] = region
+    return aliases
+
+
+REGIONS = _region_aliases()
+
+ROUTER_LOG_PATH = os.getenv(
+    'INTENT_ROUTER_LOG',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'logs', 'intent_router.jsonl')
+)
+
+
+@dataclass
+class Route:
+    decision: str                               # 'none' | 'tools' | 'llm'
+    calls: list = field(default_factory=list)   # [(함수 이름, 인자 dict), ...]
+    reason: str = ''
+
+
+class IntentRouter:
+
+    def __init__(self, log_path=ROUTER_LOG_PATH, shadow_rate=float(os.getenv('INTENT_ROUTER_SHADOW_RATE', '0'))):
+        self.log_path = log_path
+        self.shadow_rate = shadow_rate      # 로컬로 결정한 턴 중 LLM으로도 판정해 정확도를 기록할 비율
+        self.lock = threading.Lock()
+        self.counts = {'none': 0, 'tools': 0, 'llm': 0}
+
+    def route(self, message):
+        calls, unsure = [], []
+
+        regions = sorted({REGIONS[alias] for alias in REGIONS if alias in message})
+        currencies = sorted({name for name in global_currency_code if name in message})
+        names = [t.upper() for t in TICKER.findall(message) if t.upper() not in NON_TICKERS]
+        tickers = [t for t in names if t in KNOWN_TICKERS or KRX_TICKER.match(t)]
+        unknown_names = [t for t in names if t not in tickers]
+
+        if any(word in message for word in WEATHER_WORDS):
+            if len(regions) == 1:
+                calls.append(('get_celsius_temperature', {'location': regions[0]}))
+            else:
+                unsure.append('weather: 지역이 없거나 여러 개')
+
+        if currencies or any(word in message for word in CURRENCY_WORDS):
+            if len(currencies) >= 1:
+                calls += [('get_currency', {'currency_name': name}) for name in currencies]
+            else:
+                unsure.append('currency: 통화명 없음')
+
+        # 티커만으로는 바로 실행하지 않고, 주가/시세 같은 주식 문맥이 함께 있을 때만 확정한다
+        has_stock_word = any(word in message for word in STOCK_WORDS)
+        if tickers and has_stock_word and not unknown_names:
+            calls += [('get_stock_price', {'ticker': ticker}) for ticker in dict.fromkeys(tickers)]
+        elif names or has_stock_word:
+            unsure.append('stock: 종목/티커가 애매함')
+
+        if any(word in message for word in SEARCH_WORDS):
+            query = EXPLICIT_SEARCH.sub('', message).strip()
+            if query != message.strip() and query:
+                calls.append(('search_internet', {'search_query': query}))
+            else:
+                unsure.append('search: 검색 표현')
+
+        if any(word in message for word in MARKET_WORDS):
+            unsure.append('market: 시장/시사 표현')
+        if regions and not calls and not unsure:
+            unsure.append('region: 지역명만 언급')
+
+        if unsure:
+            route = Route('llm', reason='; '.join(unsure))
+        elif calls:
+            route = Route('tools', calls=calls, reason='규칙 일치')
+        elif SMALL_TALK.search(message):
+            route = Route('none', reason='인사/잡담')
+        else:
+            # 종목명·시사 질문처럼 규칙에 없는 도구 요청일 수 있으므로 analyze에 맡긴다
+            route = Route('llm', reason='도구 신호 없음')
+
+        self._record(message, route)
+        return route
+
+    def _record(self, message, route, **extra):
+        with self.lock:
+            if not extra:
+                self.counts[route.decision] += 1
+            try:
+                os.makedirs(os.path.dirname(self.log_path), exist_ok=True)
+                with open(self.log_path, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps({
+                        'time': currTime(), 'ts': time.time(), 'message': message,
+                        'decision': route.decision, 'calls': route.calls, 'reason': route.reason, **extra
+                    }, ensure_ascii=False) + '\n')
+            except Exception as e:
+                print(f'> intent_router log exception:{e}')
+
+    def shadow(self, message, route, analyze_calls):
+        # 로컬로 결정한 턴 일부를 백그라운드에서 analyze(LLM)로도 판정해 두 결정을 함께 남긴다 (정확도 측정용)
+        if route.decision == 'llm' or random.random() >= self.shadow_rate:
+            return
+
+        def run():
+            try:
+                llm_calls = analyze_calls(message)
+            except Exception as e:
+                print(f'> intent_router shadow exception:{e}')
+                return
+            local = sorted(json.dumps([name, args], sort_keys=True, ensure_ascii=False) for name, args in route.calls)
+            remote = sorted(json.dumps([name, args], sort_keys=True, ensure_ascii=False) for name, args in llm_calls)
+            self._record(message, route, shadow_llm_calls=llm_calls, agree=local == remote)
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def stats(self):
+        with self.lock:
+            total = sum(self.counts.values())
+            saved = self.counts['none'] + self.counts['tools']
+            return {**self.counts, 'analyze_calls_saved': saved, 'saved_rate': saved / total if total else 0.0}
+
+
+intent_router = IntentRouter()
@@ -1,5 +1,7 @@
 import json
-from common import client, model
+import os
+from common import async_client, model
+from pipeline_runner import PipelineRunner
 
 TOPICS = ["월급 관리", "식비/고정비 절감", "경제 공부 루틴", "투자 조언", "시간 관리"]
 
@@ -40,32 +42,34 @@ def build_prompt(topic: str) -> str:
     return (head + "\n" + body)
 
 
-conversations = []
+CONVERSATION_COUNT = int(os.getenv('CONVERSATION_COUNT', len(TOPICS)))   # 만들 대화 수 (주제를 돌아가며 사용)
+CONCURRENCY = int(os.getenv('PIPELINE_CONCURRENCY', 8))
 MAX_RETRY = 3
+OUTPUT_JSONL = '대화원천내용.jsonl'   # 끝나는 대로 한 줄씩 기록 (다시 실행하면 이어서 생성)
 
-for i in range(5):
-    for attempt in range(1, MAX_RETRY + 1):
-        try:
-            response = client.responses.create(
-                model=model.basic,
-                input=[
-                    {'role': 'developer', 'content': '당신은 유능한 극작가입니다.'},
-                    {'role': 'user', 'content': build_prompt(TOPICS[i])}
-                ],
-                max_output_tokens=6000
-            )
-            content = response.output_text
-            print('>', content)
 
-            # JSON 로드
-            conversation = json.loads(content)['data']
-            print(f'{i+1}번째 종료 (시도 {attempt})\n')
-            conversations.append(conversation)
-            break
-        except Exception as e:
-            print(f'예외 발생 (시도 {attempt}/{MAX_RETRY}), 재시도합니다. topic={TOPICS[i]} | {e}')
+async def make_conversation(topic):
+    response = await async_client.responses.create(
+        model=model.basic,
+        input=[
+            {'role': 'developer', 'content': '당신은 유능한 극작가입니다.'},
+            {'role': 'user', 'content': build_prompt(topic)}
+        ],
+        max_output_tokens=6000
+    )
+    content = response.output_text
+    print('>', content)
 
+    # JSON 로드 (실패하면 러너가 재시도)
+    return json.loads(content)['data']
 
-# conversations 리스트를 JSON 파일로 저장
-with open('대화원천내용.json', 'w', encoding='utf-8') as f:
-    json.dump(conversations, f, ensure_ascii=False, indent=4)
\ No newline at end of file
+
+if __name__ == '__main__':
+    items = [(f'{i:05d}', TOPICS[i % len(TOPICS)]) for i in range(CONVERSATION_COUNT)]
+    runner = PipelineRunner(make_conversation, OUTPUT_JSONL, concurrency=CONCURRENCY, max_retries=MAX_RETRY)
+    runner.run(items)
+
+    # 끝난 대화를 순서대로 모아 기존 형식의 JSON 파일로도 저장 (하나라도 실패했으면 저장하지 않는다)
+    conversations = runner.results([key for key, _ in items])
+    with open('대화원천내용.json', 'w', encoding='utf-8') as f:
+        json.dump(conversations, f, ensure_ascii=False, indent=4)
\ No newline at end of file
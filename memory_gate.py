@@ -0,0 +1,121 @@
+import os
+import re
+import threading
+import numpy as np
+from embedding_cache import get_embedding, get_embeddings
+
+# 과거(오늘 이전) 대화를 떠올리게 하는 회상 표현
+# '자기 전에', '식사 전에', '그때그때'처럼 일상적으로 쓰이는 시간 표현만으로는 걸리지 않도록
+# 시간 표현은 '말한/얘기했던/알려준' 같은 대화 동사와 붙어 있을 때만 본다.
+RECALL_CUES = re.compile(
+    r'예전에|저번에|지난번|지난 번|'
+    r'(?:전에|그때|그 때|어제|그저께|엊그제|지난주|지난 주|지난달|지난 달)(?:에|에는)?\s*(?:내가|네가|니가|우리가)?\s*'
+    r'(?:말한|말했|말해준|말해줬|얘기한|얘기했|얘기해준|이야기한|이야기했|알려준|알려줬|추천해준|추천했|물어본|물어봤|나눈|했던)|'
+    r'말했잖|얘기했잖|이야기했잖|알려줬잖|했잖아|말했었|얘기했었|이야기했었|'
+    r'말해줬던|말해 줬던|알려줬던|알려 줬던|추천해줬던|'
+    r'기억나|기억해|기억하|기억 나|'
+    r'(?:내가|네가|니가)\s.{0,30}(?:라고|다고)\s?했|뭐였더라|뭐라고 했더라|했었지'
+)
+
+# 로컬로 확정할 유사도 차이(긍정 예시 최대 유사도 - 부정 예시 최대 유사도)의 경계.
+# 회상 표현이 있고 차이가 POSITIVE_MARGIN보다 크면 True, 회상 표현이 없고 NEGATIVE_MARGIN 이하이면 False,
+# 그 사이는 애매한 구간으로 LLM에 맡긴다. evaluate_memory_gate.py가 LLM 판정과 비교해 권장값을 출력한다.
+POSITIVE_MARGIN = float(os.getenv('MEMORY_GATE_POSITIVE_MARGIN', '0.03'))
+NEGATIVE_MARGIN = float(os.getenv('MEMORY_GATE_NEGATIVE_MARGIN', '-0.03'))
+
+# 임베딩 유사도 비교용 라벨 예시
+POSITIVE_EXAMPLES = [
+    '예전에 내가 월급 얼마 받는다고 했는지 기억나?',
+    '저번에 말해줬던 예산 비율 다시 알려줘',
+    '어제 얘기했던 적금 방법 뭐였지?',
+    '지난번에 추천해준 가계부 앱 이름이 뭐였더라',
+    '내가 전에 고정비가 얼마라고 했었지?',
+    '그때 네가 말했던 비상금 기준 기억해?',
+    '지난주에 우리가 나눈 투자 이야기 이어서 하자',
+    '전에 이야기한 퇴직연금 얘기 기억나?',
+]
+NEGATIVE_EXAMPLES = [
+    '안녕하세요. 선생님',
+    '요즘 식비가 너무 많이 나와서 고민이에요.',
+    '적금이랑 예금 중에 뭐가 더 나아?',
+    '오늘 서울 날씨 어때?',
+    '달러 환율 얼마야?',
+    '비상금은 몇 달치 생활비로 모아야 해?',
+    '시간 관리를 잘하려면 어떻게 해야 할까요?',
+    'ETF 투자를 처음 시작하려면 뭐부터 봐야 해?',
+    '방금 말한 방법 좀 더 자세히 설명해줘',
+]
+
+
+class MemoryGate:
+    # needs_memory 앞단의 로컬 판정기
+    # 1) 회상 표현 유무, 2) 긍정/부정 예시와의 임베딩 유사도 차이로 확실한 경우만 바로 결정하고,
+    # 애매하면 None을 돌려 LLM(gpt-5) 판정으로 넘긴다.
+
+    def __init__(self, positive_margin=POSITIVE_MARGIN, negative_margin=NEGATIVE_MARGIN):
+        self.positive_margin = positive_margin
+        self.negative_margin = negative_margin
+        self.lock = threading.Lock()
+        self.examples = None
+        self.counts = {'local_true': 0, 'local_false': 0, 'llm': 0}
+
+    def _load_examples(self):
+        with self.lock:
+            if self.examples is None:
+                vectors = np.asarray(get_embeddings(POSITIVE_EXAMPLES + NEGATIVE_EXAMPLES), dtype=np.float32)
+                vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+                self.examples = (vectors[:len(POSITIVE_EXAMPLES)], vectors[len(POSITIVE_EXAMPLES):])
+        return self.examples
+
+    def similarity_margin(self, message):
+        # (가장 비슷한 긍정 예시 유사도) - (가장 비슷한 부정 예시 유사도)
+        positives, negatives = self._load_examples()
+        vector = np.asarray(get_embedding(message), dtype=np.float32)
+        vector /= np.linalg.norm(vector)
+        return float((positives @ vector).max() - (negatives @ vector).max())
+
+    @staticmethod
+    def has_recall_cue(message):
+        # 임베딩 없이 정규식만 보는 가장 싼 신호
+        return RECALL_CUES.search(message) is not None
+
+    def signals(self, message):
+        # (회상 표현 유무, 유사도 차이). 임베딩에 실패하면 차이는 None
+        has_cue = self.has_recall_cue(message)
+        try:
+            margin = self.similarity_margin(message)
+        except Exception as e:
+            print('> memory_gate error:', e)
+            margin = None
+        return has_cue, margin
+
+    @staticmethod
+    def classify(has_cue, margin, positive_margin, negative_margin):
+        if margin is None:
+            return None
+        if has_cue and margin > positive_margin:
+            return True
+        if not has_cue and margin <= negative_margin:
+            return False
+        return None
+
+    def decide(self, message):
+        has_cue, margin = self.signals(message)
+        verdict = self.classify(has_cue, margin, self.positive_margin, self.negative_margin)
+
+        self._count('llm' if verdict is None else f'local_{str(verdict).lower()}')
+        print(f'> memory_gate: cue={has_cue} margin={margin} verdict={verdict}')
+        return verdict
+
+    def _count(self, key):
+        with self.lock:
+            self.counts[key] += 1
+
+    def stats(self):
+        with self.lock:
+            total = sum(self.counts.values())
+            skipped = self.counts['local_true'] + self.counts['local_false']
+            return {**self.counts, 'llm_skip_rate': skipped / total if total else 0.0}
+
+
+memory_gate = MemoryGate()
@@ -0,0 +1,56 @@
+from pymongo import UpdateOne, ReturnDocument
+from embedding_cache import get_embeddings
+
+UPSERT_BATCH_SIZE = 100     # 벡터 저장소 업서트 1회당 벡터 수
+
+_seeded_counters = set()
+
+
+def allocate_memory_ids(counters_collection, memory_collection, count):
+    # 카운터 문서를 $inc 해서 count개의 연속된 id 블록을 원자적으로 할당한다.
+    # 여러 세션이 동시에 기억을 만들어도 id가 겹치지 않는다.
+    if counters_collection.full_name not in _seeded_counters:
+        # 카운터가 없던 기존 데이터라면 현재 최대 _id로 한 번 맞춰 둔다 ($max라 동시에 실행돼도 안전)
+        last = memory_collection.find_one(sort=[('_id', -1)], projection={'_id': 1})
+        counters_collection.update_one(
+            {'_id': 'memory_id'},
+            {'$max': {'seq': 0 if last is None else int(last['_id'])}},
+            upsert=True
+        )
+        _seeded_counters.add(counters_collection.full_name)
+
+    counter = counters_collection.find_one_and_update(
+        {'_id': 'memory_id'},
+        {'$inc': {'seq': count}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    last_id = counter['seq']
+    return list(range(last_id - count + 1, last_id + 1))
+
+
+def ingest_memories(entries, vector_store, memory_collection, counters_collection, embed=get_embeddings):
+    # entries: [{'date':..., 'keyword':..., 'summary':...}, ...]
+    # 임베딩은 묶어서 요청하고, 벡터는 배치 업서트, Mongo는 bulk_write 한 번으로 저장한다.
+    if not entries:
+        return []
+
+    ids = allocate_memory_ids(counters_collection, memory_collection, len(entries))
+    vectors = embed([entry['summary'] for entry in entries])
+
+    records = [
+        (str(_id), vector, {'date': entry['date'], 'keyword': entry['keyword']})
+        for _id, vector, entry in zip(ids, vectors, entries)
+    ]
+    for start in range(0, len(records), UPSERT_BATCH_SIZE):
+        vector_store.upsert(records[start:start + UPSERT_BATCH_SIZE])
+
+    memory_collection.bulk_write([
+        UpdateOne(
+            {'_id': _id},
+            {'$set': {'date': entry['date'], 'keyword': entry['keyword'], 'summary': entry['summary']}},
+            upsert=True
+        )
+        for _id, entry in zip(ids, entries)
+    ], ordered=False)
+    return ids
@@ -1,17 +1,37 @@
-import os
-from pymongo import MongoClient
-from common import client, today, model, yesterday, currTime
-from pinecone import Pinecone
+from common import client, today, model, yesterday, currTime, text_num_tokens, Lazy
+from embedding_cache import get_embedding
+from memory_ingest import ingest_memories
+from memory_summarizer import summarize_day
+from vector_store import create_vector_store
+from memory_gate import memory_gate
+from mongo_store import (
+    chats_collection, memory_collection, counters_collection, summary_checkpoints_collection,
+    ensure_indexes, find_by_ids, exists, CHAT_FIELDS, MEMORY_FIELDS
+)
+from semantic_cache import SemanticCache
+from chat_persister import chat_persister
+from tracing import tracer
+from datetime import datetime, timezone, timedelta
+import itertools
 import json
-
-pinecone = Pinecone(os.getenv("PINECONE_API_KEY"))
-pinecone_index = pinecone.Index('jjinchin-memory')
-
-mongo_cluster = MongoClient(os.getenv('MONGO_CLUSTER_URI'))
-mongo_chats_collection = mongo_cluster['jjinchin']['chats']
-mongo_memory_collection = mongo_cluster['jjinchin']['memory']
-
-embedding_model = "text-embedding-ada-002"
+import threading
+import uuid
+import numpy as np
+
+# VECTOR_STORE 환경변수로 백엔드 선택 (pinecone 기본, local은 프로세스 내 NumPy 인덱스)
+# 연결은 처음 검색/저장할 때 만든다
+vector_store = Lazy(create_vector_store)
+
+CANDIDATE_TOP_K = 10        # 벡터 DB에서 가져올 후보 수
+MIN_VECTOR_SCORE = 0.7      # 이 점수 이하의 후보는 버린다
+MMR_K = 4                   # MMR로 고를 후보 수 (재순위 입력)
+MMR_LAMBDA = 0.7            # 1에 가까울수록 관련성, 0에 가까울수록 다양성 우선
+LOCAL_ACCEPT_SCORE = 0.9    # 최상위 후보 점수가 이 이상이면 LLM 재순위 없이 벡터 점수로 채택
+RERANK_THRESHOLD = 0.6      # 재순위 확률이 이 미만이면 버린다
+MEMORY_TOKEN_BUDGET = 800   # 프롬프트에 넣을 기억 요약의 최대 토큰
+RESTORE_MAX_MESSAGES = 40   # 시작할 때 복원할 최근 메시지 수 상한
+RESTORE_MAX_TOKENS = 4000   # 시작할 때 복원할 최근 메시지의 토큰 상한
+RESTORE_PAGE_SIZE = 20      # 복원 시 한 번에 읽는 메시지 수
 
 NEEDS_MEMORY_TEMPLATE = """
 Answer only true/false if the user query below asks about memories before today.
@@ -19,11 +39,25 @@ Answer only true/false if the user query below asks about memories before today.
 {message}
 """
 
-MEASURING_SIMILARITY_SYSTEM_ROLE = """
+# 기억 집합이 바뀔 때(build_memory, delete_by_date)마다 올라가는 세대 번호.
+# 세션별 의미 캐시는 세대가 바뀌면 저장된 결과를 버린다.
+_memory_generation = itertools.count(1)
+memory_generation = next(_memory_generation)
+
+
+def bump_memory_generation():
+    global memory_generation
+    memory_generation = next(_memory_generation)
+
+
+def current_memory_generation():
+    return memory_generation
+
+RERANK_SYSTEM_ROLE = """
 statement1 is a question about memory.
-statement2 is a memory shared by '사용자' and '고비'.
-Answer whether statement2 is appropriate as a memory for statement1 in the following JSON format
-{"probability": <between 0 and 1>}
+candidates are memories shared by '사용자' and '고비', each with an id.
+Answer how appropriate each candidate is as a memory for statement1 in the following JSON format
+{"scores": [{"id": <id>, "probability": <between 0 and 1>}, ...]}
 """
 
 SUMMARIZING_TEMPLATE = """
@@ -42,99 +76,259 @@ SUMMARIZING_TEMPLATE = """
             ]
 }
 """
+
+MERGING_TEMPLATE = """
+당신은 같은 날의 대화를 여러 부분으로 나눠 요약한 주제 목록들을 하나로 합치는 기계입니다.
+1. 같거나 비슷한 주제는 하나로 묶고, 요약은 원래 내용을 최대한 유지하며 합칩니다.
+2. 요약 내용에는 '민수는...', '고비는...'처럼 대화자의 이름이 그대로 남아 있어야 합니다.
+3. 주제의 갯수는 무조건 5개를 넘지 말아야 합니다.
+4. "```json"과 같은 부가 정보를 포함하지 않습니다.
+```
+{
+    "data":
+            [
+                {"주제":<주제>, "요약":<요약>},
+                {"주제":<주제>, "요약":<요약>},
+            ]
+}
+"""
+
+SUMMARY_TIMEOUT = 120       # 청크 요약/합치기는 입력이 길어 기본 타임아웃보다 길게 준다
+
+
+def topic_request(template, payload):
+    # 주제 목록(JSON)을 돌려받는 요청 본문. 즉시 호출과 배치 요청 파일(batch_jobs)이 같이 쓴다
+    return {
+        'model': model.basic,
+        'input': [{'role': 'developer', 'content': template},
+                  {'role': 'user', 'content': json.dumps(payload, ensure_ascii=False)}],
+    }
+
+
+def select_mmr(query_vector, matches, k, lambda_):
+    # Maximal Marginal Relevance: 질문과의 관련성은 높고 이미 고른 후보와는 덜 겹치는 순서로 k개 선택
+    if len(matches) <= 1:
+        return [{key: v for key, v in m.items() if key != 'values'} for m in matches]
+
+    vectors = np.asarray([m['values'] for m in matches], dtype=np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    query = np.asarray(query_vector, dtype=np.float32)
+    relevance = vectors @ (query / np.linalg.norm(query))
+    similarity = vectors @ vectors.T
+
+    selected = [int(np.argmax(relevance))]
+    while len(selected) < min(k, len(matches)):
+        redundancy = similarity[:, selected].max(axis=1)
+        mmr = lambda_ * relevance - (1 - lambda_) * redundancy
+        mmr[selected] = -np.inf
+        selected.append(int(np.argmax(mmr)))
+    return [{key: v for key, v in matches[i].items() if key != 'values'} for i in selected]
+
+
+def format_memories(memories, token_budget):
+    # 순위대로 토큰 예산 안에 들어가는 만큼만 이어 붙인다
+    lines, used = [], 0
+    for memory in memories:
+        line = f"- ({memory.get('date', '')}, {memory.get('keyword', '')}) {memory['summary']}"
+        tokens = text_num_tokens(line)
+        if lines and used + tokens > token_budget:
+            break
+        lines.append(line)
+        used += tokens
+    return '\n'.join(lines) if lines else None
+
+
 class MemoryManager:
 
     def __init__(self, **kwargs):
         self.user = kwargs['user']
         self.assistant = kwargs['assistant']
-
-    def search_mongo_db(self, _id):
-        search_result = mongo_memory_collection.find_one({'_id': int(_id)})
-        print('search_result', search_result)
-        return search_result['summary']
+        self.session_id = kwargs.get('session_id', self.user)   # 대화 저장/복원 단위
+        self.semantic_cache = SemanticCache(current_memory_generation)
+        self.save_lock = threading.Lock()   # 응답 경로와 백그라운드 저장이 saved 표시를 두고 경쟁하지 않게
+        ensure_indexes()
+
+    def search_mongo_db(self, ids):
+        # 후보 기억들을 $in 쿼리 한 번으로 읽어 온다
+        with tracer.span('mongo_fetch', ids=len(ids)) as span:
+            memories = find_by_ids(memory_collection, [int(_id) for _id in ids], MEMORY_FIELDS)
+            span.set(found=len(memories))
+        return memories
 
     def search_vector_db(self, message):
-        query_vector = (
-            client.embeddings.create(input=message, model=embedding_model).data[0].embedding
+        # 상위 후보를 넉넉히 가져온 뒤 MMR로 서로 겹치지 않는 후보를 고른다
+        query_vector = get_embedding(message)
+        with tracer.span('vector_query', top_k=CANDIDATE_TOP_K) as span:
+            matches = vector_store.query(query_vector, top_k=CANDIDATE_TOP_K, include_values=True)
+            matches = [m for m in matches if m['score'] > MIN_VECTOR_SCORE]
+            span.set(matches=len(matches))
+        print('> candidates', [(m['id'], round(m['score'], 3)) for m in matches])
+        return select_mmr(query_vector, matches, MMR_K, MMR_LAMBDA)
+
+    def rerank(self, message, candidates, span=None):
+        # 모든 후보를 한 번의 LLM 호출로 채점한다.
+        # 실패하면 모든 후보를 0점으로 만들지 않고 예외를 올린다 ("기억 없음"과 구분하기 위해)
+        statement2 = [{'id': c['id'], 'memory': c['summary']} for c in candidates]
+        response = client.responses.create(
+            model=model.advanced, #gpt-5
+            input=[
+                {'role': 'developer', 'content': RERANK_SYSTEM_ROLE},
+                {'role': 'user', 'content': json.dumps(
+                    {'statement1': message, 'candidates': statement2}, ensure_ascii=False)},
+            ],
         )
-        results = pinecone_index.query(top_k=1, vector=query_vector, include_metadata=True)
-        id, score = results['matches'][0]['id'], results['matches'][0]['score']
-        print('> id', id, 'score', score)
-        return id if score > 0.7 else None
+        if span is not None:
+            span.record_usage(response)
+        scores = {str(s['id']): float(s['probability']) for s in json.loads(response.output_text)['scores']}
+        print('> rerank prob:', scores)
+        return [(c, scores.get(c['id'], 0)) for c in candidates]
 
-    def filter(self, message, memory, threshhold=0.6):
+    def retrieve_memory(self, message):
+        return self.resolve_memory(message, self.search_memory_candidates(message))
+
+    def search_memory_candidates(self, message, cancelled=None):
+        # 비슷한 질문의 조회 결과가 세션 캐시에 있으면 (True, 기억), 없으면 (False, 벡터 검색 후보)
+        # cancelled(threading.Event)가 세워져 있으면 벡터 DB 조회는 건너뛴다
+        hit, memory = self.semantic_cache.lookup(get_embedding(message))
+        if hit:
+            print('> semantic cache hit')
+            return True, memory
+        if cancelled is not None and cancelled.is_set():
+            return False, []
+        return False, self.search_vector_db(message)
+
+    def resolve_memory(self, message, searched):
+        hit, value = searched
+        if hit:
+            return value
         try:
-            response = client.responses.create(
-                model=model.advanced, #gpt-5
-                input=[
-                    {'role': 'developer', 'content': MEASURING_SIMILARITY_SYSTEM_ROLE},
-                    {'role': 'user',   'content': f'{{"statement1": {message}, "statement2": {memory}}}'},
-                ],
-            )
-            prob = json.loads(response.output_text)['probability']
-            print('> filter prob:', prob)
+            memory = self.fetch_memory(message, value)
         except Exception as e:
-            print('> filter error:', e)
-            prob = 0
-        return prob >= threshhold
+            # 재순위/DB 호출이 일시적으로 실패하면 이번 턴만 기억 없이 답하고,
+            # 세션 캐시에는 넣지 않아 비슷한 질문이 "기억 없음"으로 굳지 않게 한다
+            print('> fetch_memory error:', e)
+            return None
+        self.semantic_cache.put(get_embedding(message), memory)
+        return memory
 
-    def retrieve_memory(self, message):
-        vector_id = self.search_vector_db(message)
-        if not vector_id:
+    def fetch_memory(self, message, candidates):
+        if not candidates:
             return None
 
-        memory = self.search_mongo_db(vector_id)
-        if self.filter(message, memory):
-            return memory
-        else:
+        memories = self.search_mongo_db([c['id'] for c in candidates])
+        candidates = [dict(c, **memories[c['id']]) for c in candidates if c['id'] in memories]
+        if not candidates:
             return None
 
+        with tracer.span('filter', candidates=len(candidates)) as span:
+            if max(c['score'] for c in candidates) >= LOCAL_ACCEPT_SCORE:
+                # 벡터 점수가 충분히 높으면 로컬 점수로 채택 (재순위 호출 생략)
+                span.set(source='local')
+                scored = [(c, c['score']) for c in candidates if c['score'] >= LOCAL_ACCEPT_SCORE]
+            else:
+                span.set(source='rerank')
+                scored = [(c, p) for c, p in self.rerank(message, candidates, span) if p >= RERANK_THRESHOLD]
+            span.set(accepted=len(scored))
+
+        ranked = [c for c, _ in sorted(scored, key=lambda cp: cp[1], reverse=True)]
+        return format_memories(ranked, MEMORY_TOKEN_BUDGET)
+
     def needs_memory(self, message):
+        # 확실한 경우는 로컬 판정으로 끝내고, 애매할 때만 LLM에 묻는다
+        with tracer.span('needs_memory', source='local') as span:
+            verdict = memory_gate.decide(message)
+            if verdict is None:
+                span.set(source='llm')
+                verdict = self.needs_memory_llm(message, span)
+            span.set(verdict=verdict)
+        return verdict
+
+    def needs_memory_llm(self, message, span=None):
         try:
             response = client.responses.create(
                 model=model.advanced,
                 input=NEEDS_MEMORY_TEMPLATE.format(message=message),
             )
+            if span is not None:
+                span.record_usage(response)
 
             print('> needs_memory:', response.output_text)
             return (True if response.output_text.upper() == 'TRUE' else False)
 
         except Exception:
+            if span is not None:
+                span.outcome = 'error'
             return False
 
     def save_chat(self, context, date=None):
         save_date = date if date is not None else today()
 
-        # 1) 아직 저장 안 된 메시지만 골라오기
-        unsaved_messages = [
-            m for m in context
-            if not m.get('saved', False)  # saved가 없거나 False인 것만
-        ]
+        with self.save_lock:
+            # 1) 아직 저장 안 된 메시지만 골라서 바로 saved=True 표시 (다른 스레드가 다시 고르지 않게)
+            unsaved_messages = [
+                m for m in list(context)
+                if not m.get('saved', False)  # saved가 없거나 False인 것만
+            ]
+            for m in unsaved_messages:
+                m['saved'] = True
+                m.setdefault('id', uuid.uuid4().hex)   # 재시도해도 같은 도큐먼트가 되도록 메시지마다 고정 id
 
         if not unsaved_messages:
             return  # 새로 저장할 메시지가 없으면 바로 종료
 
-        # 2) MongoDB에 저장할 도큐먼트 구성
+        # 2) MongoDB에 저장할 도큐먼트 구성 (같은 배치 안에서도 순서가 유지되도록 1ms씩 벌린다)
+        timestamp = datetime.now(timezone.utc)
         docs = [
             {
+                '_id': m['id'],
+                'session_id': self.session_id,
+                'user': self.user,
                 'date': save_date,
+                'timestamp': timestamp + timedelta(milliseconds=i),
                 'role': m['role'],
                 'content': m['content'],
             }
-            for m in unsaved_messages
+            for i, m in enumerate(unsaved_messages)
         ]
 
-        # 3) MongoDB에 일괄 저장
-        mongo_chats_collection.insert_many(docs)
+        # 3) 응답 경로에서 기다리지 않도록 write-behind 큐에 넣는다 (백그라운드에서 일괄 저장)
+        #    끝내 저장에 실패하면 saved 표시를 되돌려 다음 save_chat이 다시 고르게 한다 (같은 _id라 중복되지 않음)
+        chat_persister.enqueue(docs, on_failed=lambda failed: self._unmark_saved(unsaved_messages, failed))
 
-        # 4) 방금 저장한 메시지들에 saved=True 표시
-        for m in context:
-            if not m.get('saved', False):
-                m['saved'] = True
+    def _unmark_saved(self, messages, failed_docs):
+        failed_ids = {doc['_id'] for doc in failed_docs}
+        with self.save_lock:
+            for m in messages:
+                if m.get('id') in failed_ids:
+                    m['saved'] = False
 
-    def restore_chat(self, date=None):
+    def restore_chat(self, date=None, *, max_messages=RESTORE_MAX_MESSAGES, max_tokens=RESTORE_MAX_TOKENS):
+        # 이 세션의 오늘 대화 중 최근 것만 seq 역순으로 페이지 단위로 읽는다.
+        # 메시지 수나 토큰 상한에 닿으면 멈추므로 오늘 대화량과 상관없이 시작 비용이 일정하다.
         search_date = date if date is not None else today()
-        search_results = mongo_chats_collection.find({'date': search_date})
+        query = {'session_id': self.session_id, 'date': search_date}
+        restored_chat, tokens = [], 0
+        while len(restored_chat) < max_messages:
+            limit = min(RESTORE_PAGE_SIZE, max_messages - len(restored_chat))
+            page = list(chats_collection.find(query, CHAT_FIELDS).sort('seq', -1).limit(limit))
+            for v in page:
+                tokens += text_num_tokens(v['content'])
+                if tokens > max_tokens:
+                    break
+                restored_chat.append({
+                    'role': v['role'],
+                    'content': v['content'],
+                    'saved': True  # 이미 DB에 있으므로 True
+                })
+            if tokens > max_tokens or len(page) < limit:
+                break
+            query['seq'] = {'$lt': page[-1]['seq']}   # 다음 페이지는 이번 페이지의 가장 오래된 메시지 이전부터
+        restored_chat.reverse()
+        return restored_chat
+
+    def load_chats(self, date):
+        # 하루치 대화 전체 (기억 만들기용). (date, timestamp) 인덱스로 찾고 정렬하며, 필요한 필드만 읽는다
+        search_results = chats_collection.find({'date': date}, CHAT_FIELDS).sort('timestamp', 1)
 
         restored_chat = [
             {
@@ -146,63 +340,72 @@ class MemoryManager:
         ]
         return restored_chat
 
-    def summarize(self, messages):
-        altered_messages = [
+    def _request_topics(self, template, payload, timeout=None):
+        # 실패하면 예외를 그대로 올린다
+        requester = client.with_options(timeout=timeout) if timeout else client
+        response = requester.responses.create(**topic_request(template, payload))
+        print('> summarize:', response.output_text)
+        return json.loads(response.output_text)['data']
+
+    def dialogue_payload(self, messages):
+        return [
             {
                 f"{self.user if message['role'] == 'user' else self.assistant}": message['content']
             } for message in messages
         ]
 
+    def _summarize_chunk(self, messages, timeout=SUMMARY_TIMEOUT):
+        return self._request_topics(SUMMARIZING_TEMPLATE, self.dialogue_payload(messages), timeout)
+
+    def _merge_topics(self, topics):
+        return self._request_topics(MERGING_TEMPLATE, topics, SUMMARY_TIMEOUT)
+
+    def summarize(self, messages):
         try:
-            context = [{'role': 'developer', 'content': SUMMARIZING_TEMPLATE},
-                       {'role': 'user', 'content': json.dumps(altered_messages, ensure_ascii=False)}]
-            response = client.responses.create(
-                model=model.basic,
-                input=context,
-            )
-            print('> summarize:', response.output_text)
-            return json.loads(response.output_text)['data']
+            return self._summarize_chunk(messages, timeout=None)
         except Exception as e:
             print('> Exception:', e)
             return []
 
     def delete_by_date(self, date):
-        search_results = mongo_memory_collection.find({'date': date})
+        search_results = memory_collection.find({'date': date}, {'_id': 1})
         ids = [str(v['_id']) for v in search_results]
         if len(ids) == 0:
             return
 
-        pinecone_index.delete(ids=ids)
-        mongo_memory_collection.delete_many({'date': date})
+        vector_store.delete(ids)
+        memory_collection.delete_many({'date': date})
+        bump_memory_generation()
 
     def save_to_memory(self, summaries, date):
-        next_id = self.next_memory_id()
-
-        for summary in summaries:
-            vector = client.embeddings.create(
-                input=summary['요약'],
-                model=embedding_model
-            ).data[0].embedding
-            metadata = {'date': date, 'keyword': summary['주제']}
-            pinecone_index.upsert([(str(next_id), vector, metadata)])
-
-            query = {'_id': next_id}  # 조회조건
-            newvalues = {'$set': {'date': date, 'keyword': summary['주제'], 'summary': summary['요약']}}
-            mongo_memory_collection.update_one(query, newvalues, upsert=True)
-            next_id += 1
-
-    def next_memory_id(self):
-        result = mongo_memory_collection.find_one(sort=[('_id', -1)])
-        return 1 if result is None else result['_id'] + 1
+        return self.save_memories({date: summaries})
+
+    def save_memories(self, summaries_by_date):
+        # 여러 날짜의 요약을 한 번에 저장한다 (임베딩 묶음 요청, 배치 업서트, bulk_write 한 번)
+        entries = [
+            {'date': date, 'keyword': summary['주제'], 'summary': summary['요약']}
+            for date, summaries in summaries_by_date.items()
+            for summary in summaries
+        ]
+        ids = ingest_memories(entries, vector_store, memory_collection, counters_collection)
+        bump_memory_generation()
+        return ids
 
     def build_memory(self):
         date = yesterday()
-        memory_results = mongo_memory_collection.find({"date":date})
-        if len(list(memory_results))>0:
+        if exists(memory_collection, {'date': date}):
             return
-        chats_results = self.restore_chat(date)
-        if len(list(chats_results))==0:
+        if not exists(chats_collection, {'date': date}):
             return
-        summaries = self.summarize(chats_results)
+        chats_results = self.load_chats(date)
+        # 긴 하루도 컨텍스트를 넘지 않게 청크로 나눠 동시에 요약하고 합친다 (실패하면 다음 실행 때 이어서)
+        summaries = summarize_day(
+            date, chats_results, summary_checkpoints_collection,
+            summarize_chunk=self._summarize_chunk,
+            merge_topics=self._merge_topics,
+        )
         self.delete_by_date(date)
+        if summaries:
+            self.save_to_memory(summaries, date)
+        summary_checkpoints_collection.delete_one({'_id': date})
 
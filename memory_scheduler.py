@@ -0,0 +1,63 @@
+from common import yesterday
+from memory_manager import MemoryManager
+
+import threading
+
+MEMORY_BUILD_INTERVAL = 3600   # 몇 초마다 만들 차례인지 확인할지
+
+
+class MemoryScheduler:
+    # 프로세스 전체에서 하나만 돌며 하루 한 번 어제 대화 전체를 기억으로 만든다.
+    # 대화 로드(load_chats)와 기억 저장소(memory 컬렉션/벡터 DB)는 사용자 구분 없이 하나이므로
+    # 등록한 사용자 수와 상관없이 날짜당 한 번만 만든다. 대화록의 화자 이름은 처음 등록한 값을 쓴다.
+
+    def __init__(self, interval=MEMORY_BUILD_INTERVAL):
+        self.interval = interval
+        self.manager = None      # 기억 만들기에 쓰는 MemoryManager
+        self.last_built = None   # 마지막으로 기억을 만든 날짜
+        self.lock = threading.Lock()          # manager 등록/조회
+        self.build_lock = threading.Lock()    # 기억 만들기는 한 번에 하나씩
+        self._wake = threading.Event()
+        self._thread = None
+
+    def register(self, user, assistant):
+        with self.lock:
+            if self.manager is None:
+                self.manager = MemoryManager(user=user, assistant=assistant)
+                self._wake.set()   # 처음 등록되면 바로 한 번 확인
+        self.start()
+
+    def start(self):
+        with self.lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True, name='memory-scheduler')
+                self._thread.start()
+
+    def run_pending(self):
+        date = yesterday()
+        with self.lock:
+            manager = self.manager
+        if manager is None:
+            return
+        with self.build_lock:
+            if self.last_built == date:
+                return
+            try:
+                manager.build_memory()
+                self.last_built = date
+            except Exception as e:
+                # 실패하면 다음 주기에 다시 시도
+                print(f'> memory_scheduler: {date} 기억 만들기 실패:{e}')
+
+    def _run(self):
+        while True:
+            self._wake.clear()
+            self.run_pending()
+            self._wake.wait(self.interval)
+
+    def stats(self):
+        with self.lock:
+            return {'registered': self.manager is not None, 'last_built': self.last_built}
+
+
+memory_scheduler = MemoryScheduler()
@@ -0,0 +1,101 @@
+from common import text_num_tokens
+
+import hashlib
+import json
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+SUMMARY_CHUNK_TOKENS = 8000    # 요약 요청 1회에 넣을 대화의 최대 토큰
+SUMMARY_CONCURRENCY = 4        # 동시에 요약할 청크 수
+MERGE_GROUP_TOKENS = 8000      # 합치기 요청 1회에 넣을 부분 주제 목록의 최대 토큰
+MAX_TOPICS = 5                 # 하루치 기억 주제 수 상한 (SUMMARIZING_TEMPLATE 규칙과 같음)
+MESSAGE_OVERHEAD_TOKENS = 8    # JSON으로 감쌀 때 메시지마다 붙는 괄호/따옴표/이름 몫
+
+
+def chunk_by_tokens(items, max_tokens, count_tokens):
+    # 순서를 유지한 채 토큰 합이 max_tokens를 넘지 않게 나눈다 (혼자서 넘는 항목은 단독 청크)
+    chunks, current, current_tokens = [], [], 0
+    for item in items:
+        tokens = count_tokens(item)
+        if current and current_tokens + tokens > max_tokens:
+            chunks.append(current)
+            current, current_tokens = [], 0
+        current.append(item)
+        current_tokens += tokens
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def message_tokens(message):
+    return text_num_tokens(message['content']) + MESSAGE_OVERHEAD_TOKENS
+
+
+def topic_tokens(topic):
+    return text_num_tokens(json.dumps(topic, ensure_ascii=False))
+
+
+def fingerprint(messages, chunk_tokens):
+    # 같은 대화, 같은 청크 크기일 때만 체크포인트를 이어 쓴다
+    digest = hashlib.sha1(str(chunk_tokens).encode())
+    for message in messages:
+        digest.update(message['role'].encode())
+        digest.update(message['content'].encode())
+    return digest.hexdigest()
+
+
+def summarize_day(date, messages, checkpoints_collection, summarize_chunk, merge_topics,
+                  chunk_tokens=SUMMARY_CHUNK_TOKENS, concurrency=SUMMARY_CONCURRENCY,
+                  merge_tokens=MERGE_GROUP_TOKENS, max_topics=MAX_TOPICS):
+    # 하루치 대화를 map-reduce로 요약한다.
+    # map: 토큰 상한으로 나눈 청크를 동시에 요약하고, 끝난 청크마다 체크포인트에 저장한다.
+    # reduce: 부분 주제 목록을 합치기 요청으로 묶어 max_topics개 이하로 줄인다 (목록이 크면 여러 단계).
+    # 중간에 실패하면 예외를 그대로 올린다. 다시 실행하면 저장된 청크는 건너뛴다.
+    chunks = chunk_by_tokens(messages, chunk_tokens, message_tokens)
+    key = fingerprint(messages, chunk_tokens)
+
+    checkpoint = checkpoints_collection.find_one({'_id': date}) or {}
+    if checkpoint.get('fingerprint') != key:
+        checkpoint = {'_id': date, 'fingerprint': key, 'chunk_count': len(chunks), 'chunks': {}}
+        checkpoints_collection.replace_one({'_id': date}, checkpoint, upsert=True)
+    if checkpoint.get('topics') is not None:
+        return checkpoint['topics']
+
+    done = checkpoint.get('chunks', {})
+    pending = [i for i in range(len(chunks)) if str(i) not in done]
+    print(f'> summarize_day {date}: 메시지 {len(messages)}개, 청크 {len(chunks)}개 (남은 청크 {len(pending)}개)')
+
+    if pending:
+        with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='summarize') as executor:
+            futures = {executor.submit(summarize_chunk, chunks[i]): i for i in pending}
+            error = None
+            for future in as_completed(futures):
+                i = futures[future]
+                try:
+                    topics = future.result()
+                except Exception as e:
+                    # 실패한 청크가 있어도 나머지 성공한 청크는 저장해 두고 마지막에 실패를 알린다
+                    error = error or e
+                    continue
+                done[str(i)] = topics
+                checkpoints_collection.update_one({'_id': date}, {'$set': {f'chunks.{i}': topics}})
+        if error is not None:
+            raise error
+
+    topics = [topic for i in range(len(chunks)) for topic in done[str(i)]]
+    while len(topics) > max_topics:
+        groups = chunk_by_tokens(topics, merge_tokens, topic_tokens)
+        if len(groups) == 1:
+            topics = merge_topics(topics)[:max_topics]
+            break
+        # 한 번에 못 넣을 만큼 많으면 묶음별로 먼저 합치고 다시 합친다
+        with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='summarize') as executor:
+            merged = list(executor.map(merge_topics, groups))
+        merged_topics = [topic for group in merged for topic in group[:max_topics]]
+        if len(merged_topics) >= len(topics):
+            # 더 줄어들지 않으면(주제 하나하나가 너무 긴 경우) 앞에서부터 자른다
+            topics = merged_topics[:max_topics]
+            break
+        topics = merged_topics
+
+    checkpoints_collection.update_one({'_id': date}, {'$set': {'topics': topics}})
+    return topics
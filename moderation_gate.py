@@ -0,0 +1,123 @@
+import re
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+
+# 불쾌한 말(욕설/비하/모욕) 어휘. 걸리면 LLM 판정으로 넘긴다
+ABUSIVE_TERMS = re.compile(
+    r'씨발|씨바|시발|시바|ㅅㅂ|ㅆㅂ|씹|좆|존나|졸라|ㅈㄴ|병신|븅신|ㅂㅅ|개새|개세|새끼|색기|ㅅㄲ|'
+    r'지랄|ㅈㄹ|미친|미쳤|또라이|돌아이|닥쳐|닥치|꺼져|엿먹|멍청|바보|한심|쓰레기|찐따|죽어|죽을래|'
+    r'fuck|shit|bitch|idiot|stupid',
+    re.IGNORECASE
+)
+
+# 앞서 한 말을 뒤집거나 부정하는 표현. 걸리면 LLM 판정으로 넘긴다
+CONTRADICTION_CUES = re.compile(
+    r'아니야|아닌데|아니거든|아니라니까|안 했|안했|한 적 없|한적 없|적 없|그런 적|그런 말|말한 적|'
+    r'거짓말|반대로|사실은|말 바꾸|말바꾸|무슨 소리|언제 그랬|취소'
+)
+
+NEGATION = re.compile(r'안 |않|못 |없|아니')
+NUMBER = re.compile(r'\d[\d,.]*')
+WORD = re.compile(r'[가-힣A-Za-z]{2,}')
+
+
+def content_words(text):
+    return set(WORD.findall(text))
+
+
+class ModerationGate:
+    # WarningAgent.monitor_user 앞단의 로컬 판정기와 판정 캐시
+    # 1) 욕설 어휘/모순 단서가 없는 창은 안전으로 바로 통과시켜, 의심스러운 창만 LLM이 판정하고,
+    # 2) 그 판정은 창 해시로 캐시하고, 앞의 발화와 상관없는 '불쾌함' 판정만 메시지 해시로도 캐시해
+    #    같은 욕설을 두 번 판정하지 않는다. (모순 판정과 그 경고는 앞의 발화에 따라 달라진다)
+
+    def __init__(self, cache_size=512):
+        self.cache_size = cache_size
+        self.lock = threading.Lock()
+        self.verdicts = OrderedDict()
+        self.counts = {'cache_hit': 0, 'local_safe': 0, 'llm': 0}
+        self.llm_seconds = 0.0
+
+    @staticmethod
+    def window_key(user, window):
+        payload = json.dumps([user] + [[m['role'], m['content']] for m in window], ensure_ascii=False)
+        return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def offensive_key(user, message):
+        payload = json.dumps([user, 'offensive', message['content']], ensure_ascii=False)
+        return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+    def lookup(self, key):
+        with self.lock:
+            verdict = self.verdicts.get(key)
+            if verdict is not None:
+                self.verdicts.move_to_end(key)
+                self.counts['cache_hit'] += 1
+            return verdict
+
+    def store(self, key, verdict):
+        with self.lock:
+            self.verdicts[key] = verdict
+            self.verdicts.move_to_end(key)
+            while len(self.verdicts) > self.cache_size:
+                self.verdicts.popitem(last=False)
+
+    def suspicion(self, window):
+        # 의심 이유를 돌려준다 (None이면 확실히 안전)
+        last = window[-1]
+        if last['role'] != 'user':
+            return None
+        message = last['content']
+        if ABUSIVE_TERMS.search(message):
+            return 'abusive_term'
+        if CONTRADICTION_CUES.search(message):
+            return 'contradiction_cue'
+
+        # 창 안의 이전 사용자 말과 같은 대상을 두고 부정 여부나 숫자가 엇갈리면 모순 의심
+        words = content_words(message)
+        numbers = set(NUMBER.findall(message))
+        for earlier in window[:-1]:
+            if earlier['role'] != 'user' or not words & content_words(earlier['content']):
+                continue
+            if bool(NEGATION.search(earlier['content'])) != bool(NEGATION.search(message)):
+                return 'negation_flip'
+            earlier_numbers = set(NUMBER.findall(earlier['content']))
+            if numbers and earlier_numbers and numbers != earlier_numbers:
+                return 'number_mismatch'
+        return None
+
+    def screen(self, window):
+        # 의심 이유를 돌려주고, 안전으로 통과시킨 창은 건너뛴 판정으로 센다
+        reason = self.suspicion(window)
+        if reason is None:
+            self._count('local_safe')
+        return reason
+
+    def record_llm(self, seconds):
+        with self.lock:
+            self.counts['llm'] += 1
+            self.llm_seconds += seconds
+
+    def _count(self, key):
+        with self.lock:
+            self.counts[key] += 1
+
+    def stats(self):
+        with self.lock:
+            total = sum(self.counts.values())
+            skipped = self.counts['cache_hit'] + self.counts['local_safe']
+            avg_llm = self.llm_seconds / self.counts['llm'] if self.counts['llm'] else 0.0
+            saved = skipped * avg_llm   # 건너뛴 판정마다 평균 LLM 판정 시간만큼 아낀 것으로 본다
+            return {
+                **self.counts,
+                'llm_skip_rate': skipped / total if total else 0.0,
+                'avg_llm_ms': avg_llm * 1000,
+                'saved_seconds': saved,
+                'saved_ms_per_turn': saved * 1000 / total if total else 0.0,
+            }
+
+
+moderation_gate = ModerationGate()
@@ -0,0 +1,76 @@
+import os
+import threading
+from pymongo import MongoClient, IndexModel, ReturnDocument, ASCENDING, DESCENDING
+from common import Lazy
+
+# 클라이언트(연결 풀)는 처음 조회/저장할 때 만든다
+mongo_cluster = Lazy(lambda: MongoClient(os.getenv('MONGO_CLUSTER_URI')))
+
+
+def _collection(name):
+    return Lazy(lambda: mongo_cluster.get_instance()['jjinchin'][name])
+
+
+chats_collection = _collection('chats')
+memory_collection = _collection('memory')
+counters_collection = _collection('counters')
+summary_checkpoints_collection = _collection('summary_checkpoints')   # 기억 만들기 중간 결과
+
+# 조회 패턴별로 필요한 인덱스 (컬렉션이 커져도 날짜/시간 조회가 전체 스캔이 되지 않게)
+INDEXES = {
+    chats_collection: [
+        IndexModel([('date', ASCENDING), ('timestamp', ASCENDING)], name='date_timestamp'),
+        # 세션별 최근 대화를 seq 역순으로 페이지 단위로 읽는다
+        IndexModel([('session_id', ASCENDING), ('date', ASCENDING), ('seq', DESCENDING)], name='session_date_seq'),
+    ],
+    memory_collection: [
+        IndexModel([('date', ASCENDING)], name='date'),
+    ],
+}
+
+# 실제로 읽는 필드만 가져온다
+CHAT_FIELDS = {'_id': 0, 'role': 1, 'content': 1, 'seq': 1}
+MEMORY_FIELDS = {'date': 1, 'keyword': 1, 'summary': 1}
+
+_indexes_lock = threading.Lock()
+_indexes_ready = False
+
+
+def ensure_indexes():
+    # 프로세스 시작 후 처음 한 번만 인덱스를 만들고(이미 있으면 무시됨) 실제로 있는지 확인한다
+    global _indexes_ready
+    with _indexes_lock:
+        if _indexes_ready:
+            return
+        try:
+            for collection, indexes in INDEXES.items():
+                collection.create_indexes(indexes)
+                existing = collection.index_information()
+                missing = [index.document['name'] for index in indexes if index.document['name'] not in existing]
+                if missing:
+                    print(f'> ensure_indexes: {collection.name} 인덱스 누락 {missing}')
+            _indexes_ready = True
+        except Exception as e:
+            print(f'> ensure_indexes exception:{e}')
+
+
+def find_by_ids(collection, ids, projection):
+    # 여러 _id를 $in 쿼리 한 번으로 읽어 {str(_id): doc} 로 돌려준다
+    results = collection.find({'_id': {'$in': list(ids)}}, projection)
+    return {str(v['_id']): v for v in results}
+
+
+def exists(collection, query):
+    # 목록을 다 읽지 않고 한 건만 확인한다
+    return collection.find_one(query, {'_id': 1}) is not None
+
+
+def allocate_seq(counters_collection, key, count):
+    # key(세션)별 카운터를 $inc 해서 count개의 연속된 순번을 원자적으로 할당하고 첫 번호를 돌려준다
+    counter = counters_collection.find_one_and_update(
+        {'_id': f'chat_seq:{key}'},
+        {'$inc': {'seq': count}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    return counter['seq'] - count + 1
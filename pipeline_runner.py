@@ -0,0 +1,119 @@
+import asyncio
+import json
+import os
+import random
+import time
+
+from openai import RateLimitError
+
+PIPELINE_CONCURRENCY = 8      # 동시에 처리할 항목 수
+PIPELINE_MAX_RETRIES = 5      # 항목당 최대 시도 횟수
+BACKOFF_BASE = 1.0            # 재시도 대기(초)의 기본값, 시도마다 두 배
+BACKOFF_MAX = 60.0
+
+
+def read_done(output_path):
+    # 이미 끝난 항목을 JSONL에서 읽는다. 중간에 끊겨 깨진 마지막 줄은 무시한다
+    done = {}
+    if not os.path.exists(output_path):
+        return done
+    with open(output_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            done[record['key']] = record['result']
+    return done
+
+
+def end_partial_line(output_path):
+    # 이전 실행이 줄 중간에 끊겼으면 줄을 끝내 두어 새 기록이 깨진 줄에 이어 붙지 않게 한다
+    if not os.path.exists(output_path) or os.path.getsize(output_path) == 0:
+        return
+    with open(output_path, 'rb+') as f:
+        f.seek(-1, os.SEEK_END)
+        if f.read(1) != b'\n':
+            f.write(b'\n')
+
+
+def retry_after(error):
+    # 429 응답의 Retry-After 헤더가 있으면 그만큼 기다린다
+    try:
+        return float(error.response.headers.get('retry-after'))
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+
+class PipelineRunner:
+    # (key, payload) 항목들을 async worker로 동시에 처리하고, 끝나는 대로 JSONL 한 줄씩 기록한다.
+    # 다시 실행하면 JSONL에 있는 key는 건너뛰므로 중간에 실패해도 이어서 처리된다.
+    # 429를 받으면 모든 worker가 함께 쉬었다가(cooldown) 다시 요청한다.
+
+    def __init__(self, worker, output_path, concurrency=PIPELINE_CONCURRENCY, max_retries=PIPELINE_MAX_RETRIES):
+        self.worker = worker
+        self.output_path = output_path
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.cooldown_until = 0.0
+        self.stats = {'done': 0, 'skipped': 0, 'failed': 0, 'retries': 0, 'rate_limited': 0}
+
+    async def _wait_cooldown(self):
+        delay = self.cooldown_until - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def _process(self, key, payload, semaphore, output):
+        async with semaphore:
+            for attempt in range(1, self.max_retries + 1):
+                await self._wait_cooldown()
+                try:
+                    result = await self.worker(payload)
+                except Exception as e:
+                    delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (attempt - 1)) * (0.5 + random.random())
+                    if isinstance(e, RateLimitError):
+                        self.stats['rate_limited'] += 1
+                        delay = retry_after(e) or delay
+                        self.cooldown_until = max(self.cooldown_until, time.monotonic() + delay)
+                    if attempt == self.max_retries:
+                        print(f'> pipeline: {key} 실패 ({attempt}회 시도) | {e}')
+                        self.stats['failed'] += 1
+                        return
+                    print(f'> pipeline: {key} 예외 발생 (시도 {attempt}/{self.max_retries}), {delay:.1f}초 후 재시도 | {e}')
+                    self.stats['retries'] += 1
+                    await asyncio.sleep(delay)
+                    continue
+
+                # 이벤트 루프 한 스레드에서만 쓰므로 줄이 섞이지 않는다
+                output.write(json.dumps({'key': key, 'result': result}, ensure_ascii=False) + '\n')
+                output.flush()
+                self.stats['done'] += 1
+                print(f'> pipeline: {key} 완료 (시도 {attempt})')
+                return
+
+    async def run_async(self, items):
+        done = read_done(self.output_path)
+        pending = [(key, payload) for key, payload in items if key not in done]
+        self.stats['skipped'] = len(items) - len(pending)
+        print(f'> pipeline: 전체 {len(items)}개 중 {len(pending)}개 처리 (완료된 {self.stats["skipped"]}개 건너뜀)')
+
+        start = time.perf_counter()
+        semaphore = asyncio.Semaphore(self.concurrency)
+        end_partial_line(self.output_path)
+        with open(self.output_path, 'a', encoding='utf-8') as output:
+            await asyncio.gather(*(self._process(key, payload, semaphore, output) for key, payload in pending))
+        self.stats['elapsed'] = round(time.perf_counter() - start, 2)
+        print(f'> pipeline: {self.stats}')
+        return self.stats
+
+    def run(self, items):
+        return asyncio.run(self.run_async(items))
+
+    def results(self, keys):
+        # 입력 순서대로 결과를 모은다. 결과 목록은 위치로 원천과 짝지어지므로(insert_memory의 날짜 등)
+        # 빠진 항목이 있으면 당겨 붙이지 않고 예외를 올린다. 다시 실행하면 빠진 항목만 이어서 처리한다
+        done = read_done(self.output_path)
+        missing = [key for key in keys if key not in done]
+        if missing:
+            raise RuntimeError(f'끝나지 않은 항목 {len(missing)}개: {missing[:5]} (다시 실행하면 이어서 처리)')
+        return [done[key] for key in keys]
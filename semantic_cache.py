@@ -0,0 +1,47 @@
+import time
+import threading
+import numpy as np
+
+
+class SemanticCache:
+    # 세션 단위 의미 캐시
+    # 질문 임베딩이 캐시된 질문과 코사인 유사도 threshold 이상이면 이전 기억 조회 결과(기억 또는 '없음')를 재사용한다.
+    # 항목은 ttl초 뒤 만료되고, 기억 집합의 세대(generation)가 바뀌면 모두 무효가 된다.
+
+    def __init__(self, generation, threshold=0.93, ttl=600, max_entries=32):
+        self.generation = generation    # 현재 기억 세대를 돌려주는 함수
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries = []   # [(정규화된 임베딩, 결과, 만료 시각, 세대)]
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _normalize(vector):
+        vector = np.asarray(vector, dtype=np.float32)
+        return vector / np.linalg.norm(vector)
+
+    def lookup(self, vector):
+        # 적중하면 (True, 결과), 아니면 (False, None)
+        query = self._normalize(vector)
+        now, generation = time.time(), self.generation()
+        with self.lock:
+            self.entries = [e for e in self.entries if e[2] > now and e[3] == generation]
+            best = max(self.entries, key=lambda e: float(e[0] @ query), default=None)
+            if best is not None and float(best[0] @ query) >= self.threshold:
+                self.hits += 1
+                return True, best[1]
+            self.misses += 1
+            return False, None
+
+    def put(self, vector, result):
+        entry = (self._normalize(vector), result, time.time() + self.ttl, self.generation())
+        with self.lock:
+            self.entries.append(entry)
+            del self.entries[:-self.max_entries]
+
+    def invalidate(self):
+        with self.lock:
+            self.entries = []
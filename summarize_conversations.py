@@ -1,7 +1,9 @@
+import hashlib
 import json
-from retry import retry
+import os
 
-from common import client, model
+from common import async_client, model
+from pipeline_runner import PipelineRunner
 
 system_role = """
 당신은 사용자의 메시지를 아래의 JSON 형식으로 대화 내용을 주제별로 요약하는 기계입니다.
@@ -20,39 +22,42 @@ system_role = """
 }
 """
 
-with open('대화원천내용.json', 'r', encoding='utf-8') as f:
-    conversations = json.load(f)
+CONCURRENCY = int(os.getenv('PIPELINE_CONCURRENCY', 8))
+MAX_RETRY = 5
+OUTPUT_JSONL = '대화내용요약.jsonl'   # 끝나는 대로 한 줄씩 기록 (다시 실행하면 이어서 요약)
 
-summaries = []
 
+async def summarize(conversation_str):
+    message = [
+        {'role': 'developer', 'content': system_role},
+        {'role': 'user', 'content': conversation_str}
+    ]
+    response = await async_client.responses.create(
+        model=model.basic,
+        input=message,
+    )
+    content = response.output_text
+    print(content)
 
-@retry(tries=5, delay=2)
-def summarize(conversation):
-    try:
+    # JSON 로드 (실패하면 러너가 재시도)
+    return json.loads(content)['data']
+
+
+if __name__ == '__main__':
+    with open('대화원천내용.json', 'r', encoding='utf-8') as f:
+        conversations = json.load(f)
+
+    # 순번 + 대화 내용 해시를 key로 써서, 원천 파일이 다시 만들어져도 같은 자리의 같은 대화는 다시 요약하지 않는다
+    # (내용이 같은 대화가 여러 번 나와도 자리마다 따로 기록된다)
+    items = []
+    for i, conversation in enumerate(conversations):
         conversation_str = json.dumps(conversation, ensure_ascii=False)
-        message = [
-            {'role': 'developer', 'content': system_role},
-            {'role': 'user', 'content': conversation_str}
-        ]
-        response = client.responses.create(
-            model=model.basic,
-            input=message,
-        )
-        content = response.output_text
-        print(content)
-
-        # JSON 로드
-        summary = json.loads(content)
-        summaries.append(summary['data'])
-
-    except Exception as e:
-        print('예외 발생, 재시도합니다.')
-        raise e
-
-
-for conversation in conversations:
-    summarize(conversation)
-
-# conversations 리스트를 JSON 파일로 저장
-with open('대화내용요약.json', 'w', encoding='utf-8') as f:
-    json.dump(summaries, f, ensure_ascii=False, indent=4)
\ No newline at end of file
+        items.append((f"{i:05d}:{hashlib.sha1(conversation_str.encode('utf-8')).hexdigest()}", conversation_str))
+
+    runner = PipelineRunner(summarize, OUTPUT_JSONL, concurrency=CONCURRENCY, max_retries=MAX_RETRY)
+    runner.run(items)
+
+    # 끝난 요약을 원천 대화 순서대로 모아 기존 형식의 JSON 파일로도 저장 (하나라도 실패했으면 저장하지 않는다)
+    summaries = runner.results([key for key, _ in items])
+    with open('대화내용요약.json', 'w', encoding='utf-8') as f:
+        json.dump(summaries, f, ensure_ascii=False, indent=4)
\ No newline at end of file
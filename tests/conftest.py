@@ -0,0 +1,5 @@
+import os
+import sys
+
+# 앱 모듈은 저장소 최상위에 평평하게 있으므로 최상위를 import 경로에 넣는다
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
@@ -0,0 +1,66 @@
+import json
+
+import batch_jobs
+from embedding_cache import EmbeddingCache
+
+
+class FakeManager:
+    # batch_jobs가 쓰는 MemoryManager 메서드만 흉내 낸다 (MongoDB/Pinecone 없이)
+
+    def __init__(self, chats_by_date):
+        self.chats_by_date = chats_by_date
+        self.deleted = []
+        self.saved = None
+
+    def load_chats(self, date):
+        return self.chats_by_date.get(date, [])
+
+    def dialogue_payload(self, messages):
+        return [{'민수' if m['role'] == 'user' else '고비': m['content']} for m in messages]
+
+    def delete_by_date(self, date):
+        self.deleted.append(date)
+
+    def save_memories(self, summaries_by_date):
+        self.saved = summaries_by_date
+        return list(range(1, sum(len(topics) for topics in summaries_by_date.values()) + 1))
+
+
+def chat(n, day):
+    return [{'role': 'user' if i % 2 == 0 else 'assistant', 'content': f'{day}일 대화 {i}번째 이야기입니다'}
+            for i in range(n)]
+
+
+def test_backfill_two_days_offline(tmp_path, monkeypatch):
+    monkeypatch.setattr(batch_jobs, 'BATCH_DIR', str(tmp_path))
+    monkeypatch.setattr(batch_jobs, 'SUMMARY_CHUNK_TOKENS', 40)   # 첫날이 여러 청크로 나뉘어 합치기까지 거치게
+    monkeypatch.setattr(batch_jobs, 'embedding_cache', EmbeddingCache(path=str(tmp_path / 'embeddings.sqlite3')))
+    manager = FakeManager({'20250101': chat(12, 1), '20250102': chat(2, 2)})   # 20250103은 대화 없음
+    path = batch_jobs.batch_path
+
+    assert batch_jobs.prepare_summaries(manager, '20250101', '20250103') > 2
+    batch_jobs.run_local(path(batch_jobs.SUMMARY_REQUESTS), path(batch_jobs.SUMMARY_RESULTS), batch_jobs.fake_responder)
+
+    assert batch_jobs.prepare_merges() == 1   # 주제가 5개를 넘는 첫날만 합친다
+    batch_jobs.run_local(path(batch_jobs.MERGE_REQUESTS), path(batch_jobs.MERGE_RESULTS), batch_jobs.fake_responder)
+
+    embedding_requests = batch_jobs.prepare_embeddings()
+    batch_jobs.run_local(path(batch_jobs.EMBEDDING_REQUESTS), path(batch_jobs.EMBEDDING_RESULTS),
+                         batch_jobs.fake_responder)
+    ids = batch_jobs.ingest(manager)
+
+    assert sorted(manager.saved) == ['20250101', '20250102']
+    assert all(0 < len(topics) <= batch_jobs.MAX_TOPICS for topics in manager.saved.values())
+    assert sorted(manager.deleted) == ['20250101', '20250102']
+    assert len(ids) == sum(len(topics) for topics in manager.saved.values())
+    # 모든 주제의 임베딩이 배치 결과로 캐시에 들어가 저장 시 추가 요청이 없다
+    assert embedding_requests == len({t['요약'] for topics in manager.saved.values() for t in topics})
+    assert all(batch_jobs.embedding_cache.get(batch_jobs.embedding_cache.make_key(t['요약'], batch_jobs.embedding_model))
+               for topics in manager.saved.values() for t in topics)
+
+    # 다시 만들어도 같은 요청이면 임베딩 요청은 0개, 빈 요청 파일은 제출하지 않는다
+    assert batch_jobs.prepare_embeddings() == 0
+    assert batch_jobs.submit(path(batch_jobs.EMBEDDING_REQUESTS)) is None
+
+    with open(path(batch_jobs.SUMMARY_RESULTS), encoding='utf-8') as f:
+        assert all(json.loads(line)['error'] is None for line in f)
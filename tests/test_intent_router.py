@@ -0,0 +1,36 @@
+import pytest
+
+from intent_router import IntentRouter
+
+
+@pytest.fixture
+def router(tmp_path):
+    return IntentRouter(log_path=str(tmp_path / 'intent_router.jsonl'))
+
+
+# 한글 종목명에 붙은 영문이나 모르는 대문자 이름은 티커로 확정하지 않고 analyze에 맡긴다
+@pytest.mark.parametrize('message', [
+    'SK하이닉스 주가 알려줘',
+    'LG전자 주가 어때?',
+    'POSCO홀딩스 현재가',
+    'NAVER 주가',
+])
+def test_korean_stock_names_go_to_llm(router, message):
+    route = router.route(message)
+    assert route.decision == 'llm'
+    assert route.calls == []
+
+
+@pytest.mark.parametrize('message, ticker', [
+    ('AAPL 주가 알려줘', 'AAPL'),
+    ('005930.KS 주가 알려줘', '005930.KS'),
+    ('000660.ks 현재가', '000660.KS'),
+])
+def test_known_tickers_run_directly(router, message, ticker):
+    route = router.route(message)
+    assert route.decision == 'tools'
+    assert route.calls == [('get_stock_price', {'ticker': ticker})]
+
+
+def test_ticker_without_stock_word_goes_to_llm(router):
+    assert router.route('AAPL 어떻게 생각해?').decision == 'llm'
@@ -0,0 +1,27 @@
+from vector_store import LocalVectorStore
+
+
+def test_local_store_round_trip(tmp_path):
+    path = str(tmp_path / 'memory')
+    store = LocalVectorStore(path)
+    store.upsert([('1', [1.0, 0.0, 0.0], {'date': '20250101'}), ('2', [0.0, 1.0, 0.0], {'date': '20250102'})])
+
+    reloaded = LocalVectorStore(path)
+    matches = reloaded.query([0.0, 1.0, 0.1], top_k=2)
+    assert [m['id'] for m in matches] == ['2', '1']
+    assert matches[0]['metadata'] == {'date': '20250102'}
+    assert [m['id'] for m in reloaded.query([1.0, 0.0, 0.0], top_k=2, filter={'date': {'$eq': '20250101'}})] == ['1']
+
+
+def test_upsert_after_reloading_empty_store(tmp_path):
+    # 모든 id를 지운 뒤 저장하면 (0, d) 행렬로 불러와진다. 그 상태에서도 다시 추가할 수 있어야 한다
+    path = str(tmp_path / 'memory')
+    store = LocalVectorStore(path)
+    store.upsert([('1', [1.0, 0.0], {'date': '20250101'})])
+    store.delete_by_filter({'date': {'$eq': '20250101'}})
+
+    reloaded = LocalVectorStore(path)
+    assert reloaded.query([1.0, 0.0]) == []
+    reloaded.upsert([('2', [0.0, 1.0], {'date': '20250102'})])
+
+    assert [m['id'] for m in LocalVectorStore(path).query([0.0, 1.0])] == ['2']
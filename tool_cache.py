@@ -0,0 +1,86 @@
+import time
+import threading
+import contextvars
+from functools import wraps
+from concurrent.futures import Future
+
+# 지금 도구 호출이 캐시에서 어떻게 처리됐는지('hits'/'misses'/'shared'). 도구 span에 남기는 데 쓴다
+cache_outcome = contextvars.ContextVar('cache_outcome', default=None)
+
+
+class ToolCache:
+    # 도구 결과 TTL 캐시 (프로세스 전체 공유)
+    # 같은 키로 동시에 들어온 호출은 하나만 실제로 실행하고 나머지는 그 결과를 기다린다(single-flight).
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self.entries = {}       # (tool, key) -> (만료 시각, 값)
+        self.inflight = {}      # (tool, key) -> Future
+        self.lock = threading.Lock()
+        self.counts = {}        # tool -> {'hits', 'misses', 'shared'}
+
+    def _count(self, tool, kind):
+        self.counts.setdefault(tool, {'hits': 0, 'misses': 0, 'shared': 0})[kind] += 1
+        cache_outcome.set(kind)
+
+    def get_or_call(self, tool, key, ttl, fn, cacheable=lambda value: value is not None):
+        cache_key = (tool, key)
+        with self.lock:
+            entry = self.entries.get(cache_key)
+            if entry is not None and entry[0] > time.time():
+                self._count(tool, 'hits')
+                return entry[1]
+            future = self.inflight.get(cache_key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self.inflight[cache_key] = future
+                self._count(tool, 'misses')
+            else:
+                self._count(tool, 'shared')
+
+        if not leader:
+            return future.result()
+
+        try:
+            value = fn()
+        except Exception as e:
+            with self.lock:
+                del self.inflight[cache_key]
+            future.set_exception(e)
+            raise
+
+        with self.lock:
+            del self.inflight[cache_key]
+            if cacheable(value):    # 실패 결과는 캐시하지 않는다
+                self.entries[cache_key] = (time.time() + ttl, value)
+                self._purge()
+        future.set_result(value)
+        return value
+
+    def _purge(self):
+        if len(self.entries) <= self.max_entries:
+            return
+        now = time.time()
+        self.entries = {k: v for k, v in self.entries.items() if v[0] > now}
+        while len(self.entries) > self.max_entries:
+            self.entries.pop(next(iter(self.entries)))
+
+    def stats(self):
+        with self.lock:
+            return {tool: {**counts, 'hit_rate': (counts['hits'] + counts['shared']) /
+                           max(1, counts['hits'] + counts['shared'] + counts['misses'])}
+                    for tool, counts in self.counts.items()}
+
+
+tool_cache = ToolCache()
+
+
+def cached_tool(name, ttl, key, cacheable=lambda value: value is not None):
+    # key: 인자(kwargs)를 정규화된 캐시 키로 바꾸는 함수
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(**kwargs):
+            return tool_cache.get_or_call(name, key(kwargs), ttl, lambda: fn(**kwargs), cacheable)
+        return wrapper
+    return decorator
@@ -0,0 +1,181 @@
+import contextvars
+import json
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+
+# 턴마다 한 줄씩 쌓는 트레이스 로그
+TRACE_LOG = os.getenv(
+    'TRACE_LOG',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'logs', 'traces.jsonl')
+)
+TRACE_WINDOW = 500   # 단계별 p50/p95 요약에 쓰는 최근 span 수
+
+# 지금 처리 중인 턴의 트레이스. 스레드 풀로 넘길 때는 tracer.bind로 컨텍스트를 복사해 간다
+current_trace = contextvars.ContextVar('current_trace', default=None)
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[int(round(q * (len(ordered) - 1)))]
+
+
+class Span:
+    # 한 단계의 실행 시간, 토큰 사용량, 결과(outcome)를 담는다
+
+    def __init__(self, stage, trace, **attrs):
+        self.stage = stage
+        self.trace = trace
+        self.attrs = attrs
+        self.outcome = 'ok'
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self.cached_tokens = 0
+        self.start = time.perf_counter()
+        self.ended = False
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def record_usage(self, response):
+        # Responses API(input/output_tokens)와 Embeddings API(prompt_tokens) 응답의 usage를 모두 받는다
+        usage = getattr(response, 'usage', None)
+        if usage is None:
+            return
+        details = getattr(usage, 'input_tokens_details', None)
+        self.input_tokens += getattr(usage, 'input_tokens', None) or getattr(usage, 'prompt_tokens', None) or 0
+        self.output_tokens += getattr(usage, 'output_tokens', None) or 0
+        self.cached_tokens += getattr(details, 'cached_tokens', None) or 0
+
+    def end(self, outcome=None):
+        if self.ended:
+            return
+        self.ended = True
+        if outcome is not None:
+            self.outcome = outcome
+        self.wall_ms = (time.perf_counter() - self.start) * 1000
+        if self.trace is not None:
+            self.trace.add(self)
+
+    def to_dict(self):
+        return {
+            'stage': self.stage,
+            'offset_ms': round((self.start - self.trace.start) * 1000, 1),
+            'wall_ms': round(self.wall_ms, 1),
+            'outcome': self.outcome,
+            'input_tokens': self.input_tokens,
+            'output_tokens': self.output_tokens,
+            'cached_tokens': self.cached_tokens,
+            **self.attrs,
+        }
+
+
+class Trace:
+    # 사용자 한 턴의 span 모음. span은 여러 스레드에서 끝나므로 잠금으로 모은다
+
+    def __init__(self, **attrs):
+        self.trace_id = uuid.uuid4().hex
+        self.attrs = attrs
+        self.timestamp = datetime.now().isoformat(timespec='milliseconds')
+        self.start = time.perf_counter()
+        self.lock = threading.Lock()
+        self.spans = []
+
+    def add(self, span):
+        with self.lock:
+            self.spans.append(span)
+
+
+class Tracer:
+    # 턴 단위 트레이스를 JSONL로 남기고, 단계별 최근 실행 시간으로 p50/p95 요약을 만든다.
+    # 턴 밖(백그라운드 기억 만들기 등)에서 열린 span은 시간만 재고 기록하지 않는다.
+
+    def __init__(self, log_path=TRACE_LOG, window=TRACE_WINDOW):
+        self.log_path = log_path
+        self.window = window
+        self.lock = threading.Lock()
+        self.stages = {}   # stage -> deque[(wall_ms, input_tokens, cached_tokens)]
+
+    def start_turn(self, **attrs):
+        trace = Trace(**attrs)
+        trace.token = current_trace.set(trace)
+        return trace
+
+    def end_turn(self, trace, outcome='ok'):
+        wall_ms = (time.perf_counter() - trace.start) * 1000
+        current_trace.reset(trace.token)
+        with trace.lock:
+            spans = sorted(trace.spans, key=lambda s: s.start)
+        record = {
+            'trace_id': trace.trace_id,
+            'timestamp': trace.timestamp,
+            'wall_ms': round(wall_ms, 1),
+            'outcome': outcome,
+            'input_tokens': sum(s.input_tokens for s in spans),
+            'output_tokens': sum(s.output_tokens for s in spans),
+            'cached_tokens': sum(s.cached_tokens for s in spans),
+            **trace.attrs,
+            'spans': [s.to_dict() for s in spans],
+        }
+        with self.lock:
+            self._observe('turn', wall_ms, record['input_tokens'], record['cached_tokens'])
+            for s in spans:
+                self._observe(s.stage, s.wall_ms, s.input_tokens, s.cached_tokens)
+            try:
+                os.makedirs(os.path.dirname(self.log_path) or '.', exist_ok=True)
+                with open(self.log_path, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps(record, ensure_ascii=False) + '\n')
+            except OSError as e:
+                print(f'> trace 기록 실패:{e}')
+        return record
+
+    def _observe(self, stage, wall_ms, input_tokens, cached_tokens):
+        if stage not in self.stages:
+            self.stages[stage] = deque(maxlen=self.window)
+        self.stages[stage].append((wall_ms, input_tokens, cached_tokens))
+
+    def start_span(self, stage, **attrs):
+        # 스트리밍 응답처럼 with 블록 밖에서 끝나는 단계용. 반드시 span.end()로 닫는다 (스트림은 on_finish로)
+        return Span(stage, current_trace.get(), **attrs)
+
+    @contextmanager
+    def span(self, stage, **attrs):
+        span = self.start_span(stage, **attrs)
+        try:
+            yield span
+        except BaseException:
+            span.end('error')
+            raise
+        span.end()
+
+    def bind(self, fn):
+        # 지금 턴의 트레이스를 스레드 풀 작업으로 넘긴다 (호출마다 컨텍스트를 복사해 동시 실행에도 안전)
+        context = contextvars.copy_context()
+
+        def run(*args, **kwargs):
+            return context.copy().run(fn, *args, **kwargs)
+        return run
+
+    def summary(self):
+        # 단계별 최근 실행 시간의 p50/p95와 평균 토큰
+        with self.lock:
+            stages = {stage: list(records) for stage, records in self.stages.items()}
+        rows = []
+        for stage, records in stages.items():
+            wall = [r[0] for r in records]
+            rows.append({
+                'stage': stage,
+                'count': len(records),
+                'p50_ms': round(percentile(wall, 0.5), 1),
+                'p95_ms': round(percentile(wall, 0.95), 1),
+                'avg_input_tokens': round(sum(r[1] for r in records) / len(records), 1),
+                'avg_cached_tokens': round(sum(r[2] for r in records) / len(records), 1),
+            })
+        return sorted(rows, key=lambda row: row['p95_ms'], reverse=True)
+
+
+tracer = Tracer()
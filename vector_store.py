@@ -0,0 +1,223 @@
+import os
+import json
+import threading
+import numpy as np
+
+PINECONE_INDEX_NAME = 'jjinchin-memory'
+
+# VECTOR_STORE=local 이면 외부 서비스 없이 프로세스 안에서 검색한다
+LOCAL_VECTOR_STORE_PATH = os.getenv(
+    'VECTOR_STORE_PATH',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache', 'vector_store')
+)
+
+
+class VectorStore:
+    # 기억 벡터 저장소 공통 인터페이스
+    # vectors: [(id, values, metadata), ...]
+    # query 결과: [{'id':..., 'score':..., 'metadata':{...}}, ...] (점수 내림차순)
+
+    def upsert(self, vectors):
+        raise NotImplementedError
+
+    def query(self, vector, top_k=1, filter=None, include_values=False):
+        raise NotImplementedError
+
+    def delete(self, ids):
+        raise NotImplementedError
+
+    def delete_by_filter(self, filter):
+        raise NotImplementedError
+
+
+class PineconeVectorStore(VectorStore):
+
+    def __init__(self, index):
+        self.index = index
+
+    def upsert(self, vectors):
+        self.index.upsert(vectors)
+
+    def query(self, vector, top_k=1, filter=None, include_values=False):
+        results = self.index.query(
+            top_k=top_k, vector=vector, filter=filter,
+            include_metadata=True, include_values=include_values
+        )
+        matches = []
+        for match in results['matches']:
+            item = {'id': match['id'], 'score': match['score'], 'metadata': match.get('metadata') or {}}
+            if include_values:
+                item['values'] = match['values']
+            matches.append(item)
+        return matches
+
+    def delete(self, ids):
+        self.index.delete(ids=ids)
+
+    def delete_by_filter(self, filter):
+        self.index.delete(filter=filter)
+
+
+def _match(metadata, filter):
+    # Pinecone 메타데이터 필터 문법의 부분집합 ($eq, $ne, $in, $nin, $gt, $gte, $lt, $lte, $and, $or)
+    for key, condition in filter.items():
+        if key == '$and':
+            if not all(_match(metadata, sub) for sub in condition):
+                return False
+            continue
+        if key == '$or':
+            if not any(_match(metadata, sub) for sub in condition):
+                return False
+            continue
+
+        value = metadata.get(key)
+        if not isinstance(condition, dict):
+            condition = {'$eq': condition}
+        for op, operand in condition.items():
+            if op == '$eq' and value != operand:
+                return False
+            if op == '$ne' and value == operand:
+                return False
+            if op == '$in' and value not in operand:
+                return False
+            if op == '$nin' and value in operand:
+                return False
+            if op in ('$gt', '$gte', '$lt', '$lte'):
+                if value is None:
+                    return False
+                if op == '$gt' and not value > operand:
+                    return False
+                if op == '$gte' and not value >= operand:
+                    return False
+                if op == '$lt' and not value < operand:
+                    return False
+                if op == '$lte' and not value <= operand:
+                    return False
+    return True
+
+
+class LocalVectorStore(VectorStore):
+    # 연속된 float32 행렬(행 = 정규화된 벡터)에 내적 한 번으로 코사인 top-k를 구하는 로컬 저장소
+    # 변경될 때마다 <path>.npy(행렬)와 <path>.json(id, 메타데이터)으로 저장한다.
+
+    def __init__(self, path=LOCAL_VECTOR_STORE_PATH):
+        self.path = path
+        self.lock = threading.Lock()
+        self.ids = []
+        self.metadata = []
+        self.rows = {}
+        self.matrix = np.zeros((0, 0), dtype=np.float32)
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path + '.json'):
+            return
+        with open(self.path + '.json', 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        self.ids = data['ids']
+        self.metadata = data['metadata']
+        self.rows = {_id: row for row, _id in enumerate(self.ids)}
+        self.matrix = np.ascontiguousarray(np.load(self.path + '.npy'), dtype=np.float32)
+
+    def _save(self):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        # 쓰는 도중 죽어도 이전 파일이 남도록 임시 파일에 쓰고 교체
+        with open(self.path + '.tmp.npy', 'wb') as f:
+            np.save(f, self.matrix[:len(self.ids)])
+        with open(self.path + '.tmp.json', 'w', encoding='utf-8') as f:
+            json.dump({'ids': self.ids, 'metadata': self.metadata}, f, ensure_ascii=False)
+        os.replace(self.path + '.tmp.npy', self.path + '.npy')
+        os.replace(self.path + '.tmp.json', self.path + '.json')
+
+    @staticmethod
+    def _normalize(values):
+        vector = np.asarray(values, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    def upsert(self, vectors):
+        with self.lock:
+            for _id, values, metadata in vectors:
+                vector = self._normalize(values)
+                if self.matrix.shape[1] != vector.shape[0]:
+                    if self.ids:
+                        raise ValueError(f'dimension mismatch: {vector.shape[0]} != {self.matrix.shape[1]}')
+                    self.matrix = np.zeros((16, vector.shape[0]), dtype=np.float32)
+
+                row = self.rows.get(str(_id))
+                if row is None:
+                    row = len(self.ids)
+                    if row == self.matrix.shape[0]:
+                        # 용량이 차면 두 배로 늘려 추가 비용을 분할 상환 (빈 채로 저장됐다 불러온 (0, d) 행렬도 여기서 늘어난다)
+                        grown = np.zeros((max(16, row * 2), self.matrix.shape[1]), dtype=np.float32)
+                        grown[:row] = self.matrix
+                        self.matrix = grown
+                    self.ids.append(str(_id))
+                    self.metadata.append(metadata or {})
+                    self.rows[str(_id)] = row
+                else:
+                    self.metadata[row] = metadata or {}
+                self.matrix[row] = vector
+            self._save()
+
+    def query(self, vector, top_k=1, filter=None, include_values=False):
+        with self.lock:
+            count = len(self.ids)
+            if count == 0:
+                return []
+            scores = self.matrix[:count] @ self._normalize(vector)
+            if filter:
+                mask = np.fromiter((_match(m, filter) for m in self.metadata), dtype=bool, count=count)
+                scores = np.where(mask, scores, -np.inf)
+
+            k = min(top_k, count)
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+
+            matches = []
+            for row in top:
+                if scores[row] == -np.inf:
+                    break
+                item = {'id': self.ids[row], 'score': float(scores[row]), 'metadata': self.metadata[row]}
+                if include_values:
+                    item['values'] = self.matrix[row].tolist()
+                matches.append(item)
+            return matches
+
+    def _delete_rows(self, rows):
+        # 지운 자리는 마지막 행을 옮겨 채워 행렬을 연속으로 유지
+        for row in sorted(rows, reverse=True):
+            last = len(self.ids) - 1
+            del self.rows[self.ids[row]]
+            if row != last:
+                self.matrix[row] = self.matrix[last]
+                self.ids[row] = self.ids[last]
+                self.metadata[row] = self.metadata[last]
+                self.rows[self.ids[row]] = row
+            self.ids.pop()
+            self.metadata.pop()
+
+    def delete(self, ids):
+        with self.lock:
+            rows = [self.rows[str(_id)] for _id in ids if str(_id) in self.rows]
+            self._delete_rows(rows)
+            self._save()
+
+    def delete_by_filter(self, filter):
+        with self.lock:
+            rows = [row for row, metadata in enumerate(self.metadata) if _match(metadata, filter)]
+            self._delete_rows(rows)
+            self._save()
+
+
+def create_vector_store(backend=None, grpc=False):
+    backend = backend or os.getenv('VECTOR_STORE', 'pinecone')
+    if backend == 'local':
+        return LocalVectorStore()
+
+    if grpc:
+        from pinecone.grpc import PineconeGRPC as Pinecone
+    else:
+        from pinecone import Pinecone
+    pinecone = Pinecone(api_key=os.getenv("PINECONE_API_KEY"))
+    return PineconeVectorStore(pinecone.Index(PINECONE_INDEX_NAME))
@@ -1,5 +1,8 @@
 import json
+import time
 from common import client
+from moderation_gate import moderation_gate
+from tracing import tracer
 
 # from pprint import pprint
 
@@ -17,6 +20,35 @@ WARNINGS = ["{user}가 불쾌한 말을 하면 안된다고 지적할 것. "
             "{user}가 모순된 말을 한다고 지적할 것. "
             "'무슨 소리하는 거니'라고 말을 시작해야 하며 20 단어를 넘기지 말 것"]
 
+# 판정과 경고 문구를 한 번에 받는 구조화 출력 모드용 (스키마로 형식을 강제)
+USER_MODERATION_TEMPLATE = """
+<대화록>을 읽고 {user}의 마지막 말을 판정하세요.
+- offensive: {user}의 마지막 대화가 불쾌한 말을 하고 있는지
+- contradictory: {user}의 마지막 대화가 모순적인 말을 하고 있는지
+- warning: 둘 중 하나라도 true이면 {assistant}가 {user}에게 바로 보낼 쓴소리, 둘 다 false이면 빈 문자열
+  - offensive가 true이면: {offensive_warning}
+  - offensive가 false이고 contradictory가 true이면: {contradictory_warning}
+<대화록>
+"""
+
+MODERATION_FORMAT = {
+    'format': {
+        'type': 'json_schema',
+        'name': 'moderation',
+        'strict': True,
+        'schema': {
+            'type': 'object',
+            'properties': {
+                'offensive': {'type': 'boolean'},
+                'contradictory': {'type': 'boolean'},
+                'warning': {'type': 'string'},
+            },
+            'required': ['offensive', 'contradictory', 'warning'],
+            'additionalProperties': False,
+        },
+    }
+}
+
 MIN_CONTEXT_SIZE = -3
 
 
@@ -31,6 +63,15 @@ class WarningAgent:
         self.warnings = (
             [value.format(user=kwargs['user']) for value in WARNINGS]
         )
+        # True면 판정과 경고 문구를 구조화 출력 한 번으로 받는다 (False면 판정 후 warn_user에서 한 번 더 호출)
+        self.structured = kwargs.get('structured', True)
+        self.user_moderation_template = USER_MODERATION_TEMPLATE.format(
+            user=kwargs['user'],
+            assistant=kwargs['assistant'],
+            offensive_warning=self.warnings[0],
+            contradictory_warning=self.warnings[1],
+        )
+        self.warning = ''
 
     def make_dialogue(self, context):
         dialogue_list = []
@@ -43,28 +84,93 @@ class WarningAgent:
         return dialogue_str
 
     def monitor_user(self, context):
+        with tracer.span('monitor') as span:
+            flagged = self._monitor_user(context, span)
+            span.set(flagged=flagged)
+        return flagged
+
+    def _monitor_user(self, context, span):
         self.checked_list = []
         self.checked_context = []
+        self.warning = ''
         if len(context) <= abs(MIN_CONTEXT_SIZE):    # 최소 컨텍스트 크기(-3)
+            span.set(source='short_context')
             return False
         self.checked_context = context[-3:]
 
+        # 욕설 어휘나 모순 단서가 없으면 LLM 없이 안전으로 판정
+        reason = moderation_gate.screen(self.checked_context)
+        if reason is None:
+            span.set(source='local_safe')
+            self.checked_list = [False, False]
+            return False
+        span.set(reason=reason)
+
+        # 이미 판정한 창이면 다시 묻지 않는다
+        key = moderation_gate.window_key(self.kwargs['user'], self.checked_context)
+        cached = moderation_gate.lookup(key)
+        if cached is not None:
+            span.set(source='cache_hit')
+            self.checked_list, self.warning = cached
+            return sum(self.checked_list) > 0
+
+        # 불쾌하다고 판정된 적 있는 메시지면 창이 달라도 바로 경고한다 (모순 여부는 따지지 않는다)
+        offensive_key = moderation_gate.offensive_key(self.kwargs['user'], self.checked_context[-1])
+        cached = moderation_gate.lookup(offensive_key)
+        if cached is not None:
+            span.set(source='cache_hit_offensive')
+            self.checked_list, self.warning = [True, False], cached
+            return True
+
+        span.set(source='llm')
         dialogue = self.make_dialogue(self.checked_context)
-        context = [
-            {'role': 'developer', 'content': '당신은 유능한 의사소통 전문가입니다.'},
-            {'role': 'user', 'content': self.user_monitor_template + dialogue}
-        ]
         try:
-            response = json.loads(self.send_query(context))
-            self.checked_list = [value for value in response.values()]
+            start = time.perf_counter()
+            if self.structured:
+                span.record_usage(self._moderate(dialogue))
+            else:
+                context = [
+                    {'role': 'developer', 'content': '당신은 유능한 의사소통 전문가입니다.'},
+                    {'role': 'user', 'content': self.user_monitor_template + dialogue}
+                ]
+                response = json.loads(self.send_query(context))
+                self.checked_list = [value for value in response.values()]
+            moderation_gate.record_llm(time.perf_counter() - start)
         except Exception as e:
             print(f'monitor-user except:[{e}]')
+            span.outcome = 'error'
             return False
 
+        moderation_gate.store(key, (self.checked_list, self.warning))
+        if self.checked_list[0]:
+            # 모순 판정이 섞인 경고는 앞의 발화에 기대므로 메시지 단위로는 불쾌함 경고만 남긴다
+            moderation_gate.store(offensive_key, self.warning if not self.checked_list[1] else '')
+
         print('self.checked_list:', self.checked_list)
         return sum(self.checked_list) > 0  # 파이썬에서 True는 숫자 1로 연산됨
 
+    def _moderate(self, dialogue):
+        # 스키마를 강제한 구조화 출력으로 두 판정과 (필요하면) 경고 문구를 한 번에 받는다
+        context = [
+            {'role': 'developer', 'content': f"당신은 유능한 의사소통 전문가이자 {self.kwargs['user']}의 잘못된 언행에 대해 "
+                                             f"따끔하게 쓴소리하는 친구 {self.kwargs['assistant']}입니다."},
+            {'role': 'user', 'content': self.user_moderation_template + dialogue}
+        ]
+        response = client.responses.create(
+            model=self.model,
+            input=context,
+            text=MODERATION_FORMAT,
+        )
+        print(f'moderation response:[{response.output_text}]')
+        result = json.loads(response.output_text)
+        self.checked_list = [result['offensive'], result['contradictory']]
+        self.warning = result['warning'].strip() if any(self.checked_list) else ''
+        return response
+
     def warn_user(self):
+        # 구조화 출력 모드에서 이미 받아 둔 경고가 있으면 추가 호출 없이 돌려준다
+        if self.warning:
+            return self.warning
         idx = [idx for idx, tf in enumerate(self.checked_list) if tf][0]
         context = [
             {'role': 'developer', 'content': f"당신은 {self.kwargs['user']}의 잘못된 언행에 대해 따끔하게 쓴소리하는 친구입니다. {self.warnings[idx]}"},